@@ -0,0 +1,130 @@
+import json
+import os
+from datetime import datetime
+from typing import List, Optional
+
+import fire
+import ollama
+import pandas as pd
+from tabulate import tabulate
+
+from cassette import Cassette
+from configs import config
+from context import RunContext
+from freyr_llm import FreyrLLM, LLMsCache
+from logger import CustomLogger
+from main import base_rng_seed, other_llm, run_test_case, tcases as default_tcases
+from metrics import StageMetrics
+from results import ResultsWriter
+from tests import TestCase
+from tool_llm import ToolCallingLLM
+
+
+def benchmark(freyr_mode: bool = True,
+              intent_llm: str = 'qwen2.5',
+              params_llm: Optional[str] = None,
+              tcases: Optional[List[str]] = None,
+              n_runs: int = 1,
+              bootstrap_mode: bool = True,
+              dirname: str = 'benchmark',
+              cassette: Optional[str] = None,
+              cassette_mode: str = 'replay',
+              cassette_latency: str = 'zero',
+              **llm_kwargs) -> None:
+	"""
+	Drives FreyrLLM or ToolCallingLLM over the test cases and reports per-stage p50/p95/p99 wall time,
+	Python-side overhead, token counts and validator pass rates.
+	Runs against the Ollama server at OLLAMA_HOST (real or `mock_ollama.py`) or offline from a cassette.
+	Extra keyword arguments are passed to the LLM constructor, so different modes can be compared.
+	"""
+	tcases = tcases if tcases is not None else default_tcases
+	params_llm = params_llm if params_llm is not None else intent_llm
+	client = Cassette(fname=cassette, mode=cassette_mode, latency=cassette_latency) if cassette is not None else ollama
+	os.makedirs(f'./experiments/{dirname}', exist_ok=True)
+	results_fname = f'./experiments/{dirname}/benchmark_results.csv'
+
+	llmcache = None
+	if freyr_mode:
+		llmcache = LLMsCache(client=client)
+		for role, model_name in [('intent', intent_llm), ('params', params_llm), ('summary', other_llm), ('chat', other_llm)]:
+			if role == 'summary' and llm_kwargs.get('summary_mode', config.llm.summary.mode) == 'templates':
+				continue  # Tool results are only summarised from templates
+			cascade = getattr(config.llm.cascade, role, None) if llm_kwargs.get('cascade', config.llm.cascade.enabled) else None
+			llmcache.try_add_model(role=role, model_name=model_name, cascade=cascade)
+		if llm_kwargs.get('speculative', config.llm.intent.speculative):
+			llmcache.try_add_model(role='draft', model_name=llm_kwargs.get('draft_model', config.llm.intent.draft_model))
+
+	metrics = StageMetrics()
+	results_writer = ResultsWriter(fname=results_fname)
+	results_writer.reset()
+	with results_writer:
+		for run_n in range(n_runs):
+			for tcase in tcases:
+				context = RunContext(seed=base_rng_seed + (run_n * 5),
+				                     logger=CustomLogger(dir_name=dirname),
+				                     metrics=metrics)
+				if freyr_mode:
+					llm = FreyrLLM(cache=llmcache, context=context, **llm_kwargs)
+				else:
+					llm = ToolCallingLLM(model_name=intent_llm, keep_loaded=True, context=context, client=client, **llm_kwargs)
+				timestamp = f'{datetime.now():%Y%m%d%H%M%S%f}'
+				context.logger.start_exp(timestamp)
+				context.logger.write_msg(source='benchmark',
+				                         msg=f'context={context}; {llm_kwargs=}')
+				run_test_case(llm=llm,
+				              tcase=TestCase(fname=tcase),
+				              use_bootstrap=bootstrap_mode,
+				              results_writer=results_writer,
+				              context=context,
+				              **{'run_n': run_n,
+				                 'timestamp': timestamp,
+				                 'intent_llm': intent_llm,
+				                 **({'params_llm': params_llm} if freyr_mode else {})})
+				context.logger.end_exp()
+
+	if freyr_mode:
+		for role in llmcache.roles:
+			llmcache.drop_model_by_role(role=role)
+	else:
+		ToolCallingLLM.unload_model(model_name=intent_llm, client=client)
+	if cassette is not None:
+		client.close()
+
+	stages = metrics.summary()
+	results_df = pd.read_csv(results_fname)
+	pass_rates = {k: float(results_df[k].astype(bool).mean()) for k in ['success', 'expected_intents', 'valid_domain', 'valid_design']}
+
+	rows = [[stage,
+	         int(s['n']),
+	         f"{s['wall_p50']:.3f}", f"{s['wall_p95']:.3f}", f"{s['wall_p99']:.3f}",
+	         f"{s['overhead_p50'] * 1e3:.2f}", f"{s['overhead_p95'] * 1e3:.2f}", f"{s['overhead_p99'] * 1e3:.2f}",
+	         f"{s['mean_calls']:.2f}", f"{s['mean_prompt_tokens']:.1f}", f"{s['mean_completion_tokens']:.1f}",
+	         f"{s['prefix_cache_hit_rate']:.1%}"]
+	        for stage, s in stages.items()]
+	print(tabulate(rows, headers=['Stage', 'N', 'Wall p50 (s)', 'Wall p95 (s)', 'Wall p99 (s)',
+	                              'Overhead p50 (ms)', 'Overhead p95 (ms)', 'Overhead p99 (ms)',
+	                              'Calls', 'Prompt Tokens', 'Completion Tokens', 'Prefix Cache Hit']))
+	print(tabulate([[k, f'{v:.1%}'] for k, v in pass_rates.items()], headers=['Check', 'Pass Rate']))
+	intent_cache = llm.intent_cache if freyr_mode else None  # Shared by all the runs, as they use the same models
+	if intent_cache is not None:
+		intent_cache.save()
+		print(intent_cache)
+	escalations = metrics.escalation_summary()
+	if len(escalations) > 0:
+		print(tabulate([[k, int(v['n']), f"{v['escalation_rate']:.1%}"] for k, v in escalations.items()],
+		               headers=['Cascade Model', 'N', 'Escalation Rate']))
+
+	with open(f'./experiments/{dirname}/benchmark.json', 'w') as f:
+		json.dump({
+			'freyr_mode': freyr_mode,
+			'intent_llm': intent_llm,
+			'params_llm': params_llm if freyr_mode else None,
+			'llm_kwargs': llm_kwargs,
+			'stages': stages,
+			'pass_rates': pass_rates,
+			'escalations': escalations
+		}, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+	fire.Fire(benchmark)
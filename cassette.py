@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from time import sleep
+from timeit import default_timer
+from typing import Any, Dict, List, Optional
+
+import ollama
+
+
+class CassetteMissError(Exception):
+	pass
+
+
+def to_dict(response: Any) -> Dict[str, Any]:
+	# Older ollama clients return dicts, newer ones return pydantic models
+	if hasattr(response, 'model_dump'):
+		return response.model_dump()
+	return dict(response)
+
+
+def request_key(api: str,
+                model: str,
+                **request) -> str:
+	request = {k: v for k, v in request.items() if v is not None}
+	canonical = json.dumps({'api': api, 'model': model, **request}, sort_keys=True, default=str, separators=(',', ':'))
+	return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class Cassette:
+	"""
+	Stand-in for the `ollama` module that records every chat/generate request and response to a
+	gzipped JSONL file, or replays them offline (with the original or zero latency).
+	Requests are keyed by a hash of the API, model, messages/prompt, tools and options.
+	"""
+	def __init__(self,
+	             fname: str,
+	             mode: str = 'replay',
+	             latency: str = 'original',
+	             client: Any = ollama):
+		assert mode in ['record', 'replay'], f'Unknown cassette mode: {mode}'
+		assert latency in ['original', 'zero'], f'Unknown cassette latency: {latency}'
+		self.fname = fname
+		self.mode = mode
+		self.latency = latency
+		self.client = client
+		self.__lock = threading.Lock()
+		self.__entries: Dict[str, deque] = defaultdict(deque)
+		self.__last: Dict[str, Dict[str, Any]] = {}
+		self.__models: List[str] = []
+		self.__f = None
+		if self.mode == 'replay':
+			self.__load()
+		else:
+			os.makedirs(os.path.dirname(self.fname) or '.', exist_ok=True)
+			self.__f = gzip.open(self.fname, 'at', encoding='utf-8')
+
+	def __load(self) -> None:
+		with gzip.open(self.fname, 'rt', encoding='utf-8') as f:
+			try:
+				for line in f:
+					if line.strip() == '': continue
+					try:
+						entry = json.loads(line)
+					except json.JSONDecodeError:
+						break  # Partial entry from an interrupted recording
+					self.__entries[entry['key']].append(entry)
+					if entry['model'] not in self.__models:
+						self.__models.append(entry['model'])
+			except EOFError:
+				pass  # Recording was interrupted before the gzip trailer was written
+
+	def close(self) -> None:
+		with self.__lock:
+			if self.__f is not None:
+				self.__f.close()
+				self.__f = None
+
+	def __record(self,
+	             api: str,
+	             model: str,
+	             request: Dict[str, Any]) -> Dict[str, Any]:
+		key = request_key(api=api, model=model, **request)
+		start = default_timer()
+		try:
+			response = getattr(self.client, api)(model=model, **request)
+			# Streams are recorded whole and replayed chunk by chunk
+			response = [to_dict(chunk) for chunk in response] if request.get('stream', False) else to_dict(response)
+			error = None
+		except ollama.ResponseError as e:
+			# Errors are part of the behaviour to replay (e.g. models that do not support tools)
+			response = None
+			error = {'error': e.error, 'status_code': e.status_code}
+		end = default_timer()
+		entry = {'key': key, 'api': api, 'model': model, 'latency': end - start, 'response': response, 'error': error}
+		with self.__lock:
+			self.__f.write(json.dumps(entry, default=str) + '\n')
+			self.__f.flush()
+		if error is not None:
+			raise ollama.ResponseError(error['error'], error['status_code'])
+		return response
+
+	def __replay(self,
+	             api: str,
+	             model: str,
+	             request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+		key = request_key(api=api, model=model, **request)
+		with self.__lock:
+			if len(self.__entries[key]) > 0:
+				# Identical requests are served in the order they were recorded, then the last one is repeated
+				self.__last[key] = self.__entries[key].popleft()
+			entry = self.__last.get(key, None)
+		if entry is None:
+			return None
+		if self.latency == 'original':
+			sleep(entry['latency'])
+		if entry.get('error', None) is not None:
+			raise ollama.ResponseError(entry['error']['error'], entry['error']['status_code'])
+		return entry['response']
+
+	def chat(self,
+	         model: str,
+	         messages: List[Dict[str, Any]],
+	         tools: Optional[List[Dict[str, Any]]] = None,
+	         options: Optional[Dict[str, Any]] = None,
+	         **kwargs) -> Dict[str, Any]:
+		request = {'messages': messages, 'tools': tools, 'options': options, **kwargs}
+		if self.mode == 'record':
+			response = self.__record(api='chat', model=model, request=request)
+		else:
+			response = self.__replay(api='chat', model=model, request=request)
+		if response is None:
+			raise CassetteMissError(f'No recorded chat response for {model} in {self.fname}')
+		return iter(response) if request.get('stream', False) else response
+
+	def generate(self,
+	             model: str,
+	             prompt: str = '',
+	             options: Optional[Dict[str, Any]] = None,
+	             **kwargs) -> Dict[str, Any]:
+		request = {'prompt': prompt, 'options': options, **kwargs}
+		if self.mode == 'record':
+			return self.__record(api='generate', model=model, request=request)
+		response = self.__replay(api='generate', model=model, request=request)
+		if response is None:
+			if prompt == '':
+				# Loading/unloading calls do not need to be on the cassette
+				return {'model': model, 'response': '', 'done': True}
+			raise CassetteMissError(f'No recorded generate response for {model} in {self.fname}')
+		return response
+
+	def list(self) -> Dict[str, Any]:
+		if self.mode == 'record':
+			return to_dict(self.client.list())
+		return {'models': [{'name': model_name} for model_name in self.__models]}
+
+	def ps(self) -> Dict[str, Any]:
+		if self.mode == 'record':
+			return to_dict(self.client.ps())
+		return {'models': []}
+
+	def pull(self,
+	         model: str,
+	         **kwargs) -> Dict[str, Any]:
+		if self.mode == 'record':
+			return to_dict(self.client.pull(model, **kwargs))
+		return {'status': 'success'}
@@ -0,0 +1,37 @@
+from typing import Any, Dict, Optional
+
+from configs import config
+from logger import CustomLogger, custom_logger
+from metrics import StageMetrics
+
+
+class RunContext:
+	"""
+	Everything a single run needs that used to live in module-level state:
+	the seed, the sampling options, where to log and where to write outputs, and its stage metrics.
+	Each concurrent run gets its own context, so runs never clobber each other.
+	"""
+	def __init__(self,
+	             seed: Optional[int] = None,
+	             options: Optional[Dict[str, Any]] = None,
+	             logger: Optional[CustomLogger] = None,
+	             metrics: Optional[StageMetrics] = None):
+		self.seed = seed if seed is not None else config.rng_seed
+		self.options = {
+			'temperature': config.llm.temperature,
+			'top_p': config.llm.top_p,
+			**(options or {})
+		}
+		self.logger = logger if logger is not None else custom_logger
+		self.metrics = metrics if metrics is not None else StageMetrics()
+	
+	@property
+	def out_dir(self) -> str:
+		return f'./experiments/{self.logger.dir_name}'
+	
+	@property
+	def llm_options(self) -> Dict[str, Any]:
+		return {**self.options, 'seed': self.seed}
+	
+	def __str__(self) -> str:
+		return f'RunContext(seed={self.seed}, options={self.options}, out_dir={self.out_dir}, expname={self.logger.expname})'
@@ -0,0 +1,150 @@
+import asyncio
+from timeit import default_timer
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import ollama
+
+from context import RunContext
+from freyr_llm import FreyrLLM, LLMsCache
+from llm_steps import AsyncChatStream, adrive
+from dungeon_despair.domain.level import Level
+
+
+class ThreadedAsyncClient:
+	"""
+	Async view of a blocking client (e.g. a Cassette): each chat call runs in a worker thread.
+	"""
+	def __init__(self,
+	             client: Any):
+		self.client = client
+	
+	async def chat(self,
+	               **kwargs) -> Any:
+		res = await asyncio.to_thread(self.client.chat, **kwargs)
+		if kwargs.get('stream', False):
+			return ThreadedAsyncClient.__iterate(chunks=iter(res))
+		return res
+	
+	@staticmethod
+	async def __iterate(chunks: Iterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+		end = object()
+		while (chunk := await asyncio.to_thread(next, chunks, end)) is not end:
+			yield chunk
+
+
+def get_async_client(client: Any = ollama) -> Any:
+	# The client must be created within the event loop that uses it
+	if client is ollama:
+		return ollama.AsyncClient()
+	return ThreadedAsyncClient(client=client)
+
+
+class AsyncFreyrLLM(FreyrLLM):
+	"""
+	FreyrLLM whose model calls are awaited, so many conversations can share a single event loop.
+	Prompts, parsing, tool calls and logs are the same as FreyrLLM's, as both run the same steps.
+	"""
+	def __init__(self,
+	             cache: LLMsCache,
+	             context: Optional[RunContext] = None,
+	             async_client: Optional[Any] = None,
+	             **kwargs):
+		# `kwargs` are FreyrLLM's modes (stream_intents, batch_params, fused_params, cascade, ...)
+		super().__init__(cache=cache, context=context, **kwargs)
+		self.async_client = async_client if async_client is not None else get_async_client(client=cache.client)
+	
+	async def __achat(self,
+	                  model_name: str,
+	                  messages: List[Dict[str, str]]) -> Dict[str, Any]:
+		request, prompt_size = self._chat_request(model_name=model_name, messages=messages)
+		res = self.response_cache.get(request) if self.response_cache is not None else None
+		if res is None:
+			start = default_timer()
+			res = await self.async_client.chat(**request)
+			end = default_timer()
+			self._chat_done(res=res, elapsed=end - start, prompt_size=prompt_size)
+			if self.response_cache is not None:
+				self.response_cache.put(request=request, response=res)
+		return res
+	
+	async def __astream(self,
+	                    model_name: str,
+	                    messages: List[Dict[str, str]]) -> AsyncChatStream:
+		request, prompt_size = self._chat_request(model_name=model_name, messages=messages)
+		chunks = await self.async_client.chat(**request, stream=True)
+		return AsyncChatStream(chunks=chunks,
+		                       prompt_size=prompt_size)
+	
+	async def extract_intents(self,
+	                          conversation_history: List[Dict[str, str]],
+	                          user_message: str,
+	                          level: Level) -> List[str]:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.extract_intents_steps(conversation_history=conversation_history,
+		                                                     user_message=user_message,
+		                                                     level=level))
+	
+	async def extract_intents_and_params(self,
+	                                     conversation_history: List[Dict[str, str]],
+	                                     user_message: str,
+	                                     level: Level) -> Tuple[List[str], Optional[List[str]]]:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.extract_intents_and_params_steps(conversation_history=conversation_history,
+		                                                                user_message=user_message,
+		                                                                level=level))
+	
+	async def generate_params_and_execute_tool(self,
+	                                           conversation_history: List[Dict[str, str]],
+	                                           user_message: str,
+	                                           intent: str,
+	                                           level: Level) -> str:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.generate_params_and_execute_tool_steps(conversation_history=conversation_history,
+		                                                                      user_message=user_message,
+		                                                                      intent=intent,
+		                                                                      level=level))
+	
+	async def generate_batch_params_and_execute_tools(self,
+	                                                  conversation_history: List[Dict[str, str]],
+	                                                  user_message: str,
+	                                                  intents: List[str],
+	                                                  level: Level) -> List[str]:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.generate_batch_params_and_execute_tools_steps(conversation_history=conversation_history,
+		                                                                             user_message=user_message,
+		                                                                             intents=intents,
+		                                                                             level=level))
+	
+	async def summarize_tool_results(self,
+	                                 tool_results: List[str],
+	                                 level: Level,
+	                                 intents: Optional[List[str]] = None) -> str:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.summarize_tool_results_steps(tool_results=tool_results,
+		                                                            level=level,
+		                                                            intents=intents))
+	
+	async def chat(self,
+	               conversation_history: List[Dict[str, str]],
+	               user_message: str,
+	               level: Level) -> str:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.chat_steps(conversation_history=conversation_history,
+		                                          user_message=user_message,
+		                                          level=level))
+	
+	async def __call__(self,
+	                   user_message: str,
+	                   conversation_history: List[str],
+	                   level: Level) -> str:
+		return await adrive(achat=self.__achat,
+		                    astream=self.__astream,
+		                    steps=self.call_steps(user_message=user_message,
+		                                          conversation_history=conversation_history,
+		                                          level=level))
@@ -1,31 +1,44 @@
+import hashlib
 import json
-import subprocess
+import re
 from time import sleep
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set, Tuple
 
 import ollama
 from timeit import default_timer
 
+from cassette import CassetteMissError
 from configs import config
+from context import RunContext
+from history import HistoryCompactor, get_history_compactor
+from intent_cache import get_intent_cache
+from llm_steps import ChatStream, Steps, drive
+from metrics import StageRecord
+from tool_schema import get_tool_schema_index
+from level_render import FocusedLevelView, LevelDeltaRenderer, LevelRenderer
+from prompts import VOLATILE_SECTIONS, build_messages
+from response_cache import get_response_cache
+from summary_templates import NOT_EXECUTED, RETRIES_EXHAUSTED, render_summary
+from tokens import get_prompt_guard
 from dungeon_despair.domain.level import Level
 from dungeon_despair.functions import DungeonCrawlerFunctions
 
-from logger import custom_logger
-
 
 class LLMsCache:
-	def __init__(self):
+	def __init__(self,
+	             client: Any = ollama):
 		self.timeout = 0.8
+		self.client = client  # The ollama module or anything with the same API (e.g. a Cassette)
 		self.__cache: Dict[str, Dict[str, str]] = {}
-		self.ollama_models = LLMsCache.get_ollama_models()
+		self.ollama_models = LLMsCache.get_ollama_models(client=self.client)
 	
 	@property
 	def roles(self) -> List[str]:
 		return list(self.__cache.keys())
 	
 	@staticmethod
-	def get_ollama_models() -> List[str]:
-		return [x['name'] for x in ollama.list()['models']]
+	def get_ollama_models(client: Any = ollama) -> List[str]:
+		return [x['name'] for x in client.list()['models']]
 	
 	@staticmethod
 	def load_prompt(role: str) -> str:
@@ -37,6 +50,8 @@ class LLMsCache:
 			fname = config.llm.summary.prompt
 		elif role == 'chat':
 			fname = config.llm.chat.prompt
+		elif role == 'draft':
+			fname = config.llm.intent.prompt  # Drafts the intents (see FreyrLLM's speculative mode)
 		else:
 			raise ValueError(f'Unknown role: {role}')
 		prompt = ''
@@ -46,15 +61,20 @@ class LLMsCache:
 		
 	def try_add_model(self,
 	                  role: str,
-	                  model_name: str) -> None:
+	                  model_name: str,
+	                  cascade: Optional[List[str]] = None) -> None:
+		# `cascade` lists cheaper models to try before `model_name`, in order (see FreyrLLM's cascade mode)
 		assert role not in self.roles, f'{role} already has a model: {self.__cache[role]}'
-		if f'{model_name}:latest' not in self.ollama_models or model_name not in self.ollama_models:
-			ollama.pull(model_name)
-			self.ollama_models = LLMsCache.get_ollama_models()
-		ollama.generate(model=model_name, keep_alive=-1)
+		models = [x for x in (cascade or []) if x != model_name] + [model_name]
+		for x in models:
+			if f'{x}:latest' not in self.ollama_models or x not in self.ollama_models:
+				self.client.pull(x)
+				self.ollama_models = LLMsCache.get_ollama_models(client=self.client)
+			self.client.generate(model=x, keep_alive=-1)
 		self.__cache[role] = {
 			'prompt': LLMsCache.load_prompt(role),
-			'model': model_name
+			'model': model_name,
+			'cascade': models
 		}
 	
 	def get_model_by_role(self,
@@ -62,6 +82,11 @@ class LLMsCache:
 		assert role in self.__cache, f'{role} has no associated model'
 		return self.__cache[role]['model']
 	
+	def get_cascade_by_role(self,
+	                        role: str) -> List[str]:
+		assert role in self.__cache, f'{role} has no associated model'
+		return self.__cache[role]['cascade']
+	
 	def get_prompt_by_role(self,
 	                       role: str) -> str:
 		assert role in self.__cache, f'{role} has no associated prompt'
@@ -72,55 +97,195 @@ class LLMsCache:
 		return role in self.roles and self.__cache[role]['model'] != ''
 	
 	def drop_model_by_role(self,
-	                       role: str) -> None:
-		model_id = self.__cache[role]['model']
+	                       role: str,
+	                       keep: Optional[Set[str]] = None) -> None:
+		# `keep` lists models to leave running even if no other role uses them (e.g. they are about to be added again)
 		other_roles = set(self.roles)
 		other_roles.remove(role)
-		# Stop a model ONLY if not used in another role
-		if model_id not in [self.__cache[x]['model'] for x in list(other_roles)]:
-			try:
-				subprocess.check_call(['ollama', 'stop', model_id])
-				sleep(self.timeout)
-				assert model_id not in [x['name'] for x in ollama.ps()['models']], f'Could not stop model {model_id}'
-			except subprocess.CalledProcessError as e:
-				print(f'Failed to unload model {model_id} for role {role}: {e}')
+		other_models = [model_id for x in list(other_roles) for model_id in self.__cache[x]['cascade']]
+		for model_id in self.__cache[role]['cascade']:
+			# Stop a model ONLY if not used in another role
+			if model_id not in other_models and model_id not in (keep or set()):
+				try:
+					# Same as `ollama stop`, but through the client
+					self.client.generate(model=model_id, keep_alive=0)
+					sleep(self.timeout)
+					assert model_id not in [x['name'] for x in self.client.ps()['models']], f'Could not stop model {model_id}'
+				except ollama.ResponseError as e:
+					print(f'Failed to unload model {model_id} for role {role}: {e}')
 		del self.__cache[role]
 
 
+class IntentsStreamParser:
+	"""
+	Incremental version of FreyrLLM.polish_intents_output: intents are returned as soon as their trailing comma
+	has been decoded, and the list ends at the first empty line.
+	"""
+	def __init__(self):
+		self.text = ''
+		self.done = False
+		self.__pos = 0  # Start of the intent being decoded
+	
+	def feed(self,
+	         chunk: Optional[str]) -> List[str]:
+		# Pass None once the stream is over to get the last intent
+		if self.done:
+			return []
+		if chunk is not None:
+			self.text += chunk
+		end = self.text.find('\n\n', self.__pos)
+		if end != -1 or chunk is None:
+			self.done = True
+		pending = self.text[self.__pos:end if end != -1 else len(self.text)]
+		if self.done:
+			intents = pending.split(',')
+		else:
+			intents = pending.split(',')[:-1]
+			self.__pos += len(pending) - len(pending.split(',')[-1])
+		intents = [intent.strip() for intent in intents]
+		return [intent for intent in intents if intent != '']
+
+
 class FreyrLLM:
 	def __init__(self,
-	             cache: LLMsCache):
+	             cache: LLMsCache,
+	             context: Optional[RunContext] = None,
+	             stream_intents: Optional[bool] = None,
+	             prompt_layout: Optional[str] = None,
+	             level_delta: Optional[bool] = None,
+	             level_view: Optional[bool] = None,
+	             level_formats: Optional[Dict[str, str]] = None,
+	             history: Optional[bool] = None,
+	             response_cache: Optional[bool] = None,
+	             batch_params: Optional[bool] = None,
+	             fused_params: Optional[bool] = None,
+	             cascade: Optional[bool] = None,
+	             speculative: Optional[bool] = None,
+	             draft_model: Optional[str] = None,
+	             intent_cache: Optional[bool] = None,
+	             summary_mode: Optional[str] = None):
 		self.tools = DungeonCrawlerFunctions()
+		self.schema = get_tool_schema_index()
+		self.level_renderer = LevelRenderer()
+		level_delta = level_delta if level_delta is not None else config.llm.level_delta.enabled
+		self.level_delta = LevelDeltaRenderer(renderer=self.level_renderer,
+		                                      refresh_ratio=config.llm.level_delta.refresh_ratio) if level_delta else None
+		# Intents and parameters only get the part of large levels that is relevant to the request
+		level_view = level_view if level_view is not None else config.llm.level_view.enabled
+		self.level_view = FocusedLevelView(renderer=self.level_renderer,
+		                                   hops=config.llm.level_view.hops,
+		                                   min_rooms=config.llm.level_view.min_rooms) if level_view else None
+		# How the level is written in the prompts of each role (see LEVEL_FORMATS)
+		self.level_formats = {role: getattr(config.llm, role).level_format for role in ['intent', 'params', 'summary', 'chat']}
+		self.level_formats.update(level_formats if level_formats is not None else {})
 		self.history_cutoff_idx = 0
+		self.history = get_history_compactor(enabled=history)
+		self.prompt_guard = get_prompt_guard()
+		self.response_cache = get_response_cache(enabled=response_cache)
 		self.cache = cache
+		self.context = context if context is not None else RunContext()
+		self.stream_intents = stream_intents if stream_intents is not None else config.llm.intent.stream
+		self.prompt_layout = prompt_layout if prompt_layout is not None else config.llm.prompt_layout
+		self.batch_params = batch_params if batch_params is not None else config.llm.params.batch
+		self.fused_params = fused_params if fused_params is not None else config.llm.intent.fused
+		self.cascade = cascade if cascade is not None else config.llm.cascade.enabled
+		self.speculative = speculative if speculative is not None else config.llm.intent.speculative
+		self.draft_model = draft_model if draft_model is not None else config.llm.intent.draft_model
+		self.speculations = {'accepted': 0, 'rejected': 0, 'skipped': 0}
+		self.intents_from_cache = False  # Whether the intents of the last turn came from the intent cache
+		self.summary_mode = summary_mode if summary_mode is not None else config.llm.summary.mode
+		assert self.summary_mode in ['templates', 'fallback', 'llm'], f'Unknown summary mode: {self.summary_mode}'
+		self.summaries = {'templates': 0, 'llm': 0}
 		
 		self.intents_dict = {
 			"conversation (msg)": "Ask for details, clarifications, or suggestions.",
 			**self.tools_as_dict(),
 		}
+		self.intents_str = str(self.intents_dict)
+		self.intent_names = {'conversation', *self.schema.descriptions}
+		self.intents_params_str = '\n'.join([f'- {name}: {description}' if name not in self.schema.op_params_str else
+		                                      f'- {name}: {description} Parameters: {self.schema.op_params_str[name]}'
+		                                      for name, description in self.intents_dict.items()])
 		
 		self.PARAM_ERROR_MSG = 'OpError'
 		
 		with open(config.llm.params.err_msg, 'r') as f:
 			self.feedback_error = f.read()
+		with open(config.llm.params.prompt_batch, 'r') as f:
+			self.params_batch_prompt = f.read()
+		with open(config.llm.intent.prompt_fused, 'r') as f:
+			self.intent_params_prompt = f.read()
+		self.intent_cache = get_intent_cache(key=self.intent_cache_key(), enabled=intent_cache)
 			
 		self.intents = []  # For testing purposes only
 	
+	def _chat_request(self,
+	                  model_name: str,
+	                  messages: List[Dict[str, str]]) -> Tuple[Dict[str, Any], int]:
+		# Arguments of a chat call, shared by the blocking and the async clients, and its predicted prompt tokens
+		messages, n_tokens, num_ctx = self.prompt_guard.fit(model_name=model_name, messages=messages)
+		return {
+			'model': model_name,
+			'messages': messages,
+			'options': {
+				**self.context.llm_options,
+				'num_ctx': num_ctx
+			}
+		}, n_tokens
+	
+	def _chat_done(self,
+	               res: Dict[str, Any],
+	               elapsed: float,
+	               prompt_size: int = 0) -> None:
+		# prompt_eval_count only counts the tokens that were not in the server's prompt cache
+		self.context.metrics.add_llm_call(llm_time=elapsed,
+		                                  prompt_tokens=res.get('prompt_eval_count', 0),
+		                                  completion_tokens=res.get('eval_count', 0),
+		                                  prompt_size=prompt_size)
+	
 	def __chat(self,
 	           model_name: str,
 	           messages: List[Dict[str, str]]) -> Dict[str, Any]:
-		options = {
-			'temperature': config.llm.temperature,
-			'top_p': config.llm.top_p,
-			'seed': config.rng_seed
-		}
-		res = ollama.chat(model=model_name,
-		                  messages=messages,
-		                  options=options)
+		request, prompt_size = self._chat_request(model_name=model_name, messages=messages)
+		res = self.response_cache.get(request) if self.response_cache is not None else None
+		if res is None:
+			start = default_timer()
+			res = self.cache.client.chat(**request)
+			end = default_timer()
+			self._chat_done(res=res, elapsed=end - start, prompt_size=prompt_size)
+			if self.response_cache is not None:
+				self.response_cache.put(request=request, response=res)
 		return res
-		
+	
+	def __stream(self,
+	             model_name: str,
+	             messages: List[Dict[str, str]]) -> ChatStream:
+		request, prompt_size = self._chat_request(model_name=model_name, messages=messages)
+		return ChatStream(chunks=self.cache.client.chat(**request, stream=True),
+		                  prompt_size=prompt_size)
+	
+	@staticmethod
+	def stream_prompt_tokens(stream: Any) -> int:
+		# Streams closed early never get the server's count, so the prompt counted before the request stands in
+		return stream.output.get('prompt_eval_count', stream.prompt_size)
+	
+	def _stream_done(self,
+	                 stream: Any,
+	                 stage: str) -> None:
+		# The stream overlaps the calls made while it decodes: its own stage is recorded apart, and the
+		# enclosing stages only count the time spent waiting on it
+		output = stream.output if stream.output.get('done', False) else {'eval_count': stream.n_chunks}
+		self._chat_done(res=output, elapsed=stream.wait_time, prompt_size=stream.prompt_size)
+		record = StageRecord(stage=stage)
+		record.wall_time = record.llm_time = stream.elapsed
+		record.n_calls = 1
+		record.prompt_tokens = output.get('prompt_eval_count', 0)
+		record.completion_tokens = output.get('eval_count', 0)
+		record.prompt_size = stream.prompt_size
+		self.context.metrics.add_record(record)
+	
 	def tools_as_dict(self) -> Dict[str, str]:
-		return {x["function"]["name"]: x["function"]["description"] for x in self.tools.get_tool_schema()}
+		return dict(self.schema.descriptions)
 	
 	@staticmethod
 	def polish_intents_output(response: str):
@@ -142,8 +307,8 @@ class FreyrLLM:
 			param_name = param_name.replace('-', '').strip()
 			# polish param_value
 			param_value = param_value.strip()
-			param_type = self.get_tool_param_type(tool_name=tool_name,
-			                                      param_name=param_name)
+			coerce = self.schema.get_coercer(tool_name=tool_name,
+			                                 param_name=param_name)
 			if param_value != '':
 				param_value = param_value.replace(':', '').replace('"', '').replace('\'', '').strip()
 				if param_value == 'None': param_value = ''
@@ -152,51 +317,55 @@ class FreyrLLM:
 				# empty string check
 				if param_value == '""': param_value = ''
 				if param_value == "''": param_value = ''
-				if param_value != '':
-					# convert param_value to its correct type
-					if param_type != str and param_value.lstrip('-').replace('.', '', 1).isdigit():
-						param_value = param_type(eval(param_value))  # Allow for floats to be cast to int from string, basically
-					else:
-						param_value = param_type(param_value)
-				else:
-					param_value = param_type()
-			else:
-				param_value = param_type()
+			# convert param_value to its correct type (empty values become the default of the type)
+			param_value = coerce(param_value)
 			tool_args[param_name] = param_value
 		return tool_args
 	
 	def get_tool_parameters(self,
 	                        tool_name) -> Dict[str, str]:
-		tool_schema = self.tools.get_tool_schema()
-		tool_idx = [x["function"]["name"] for x in tool_schema].index(tool_name)
-		tool = tool_schema[tool_idx]
-		params = {k[0]: k[1]['description'] for k in tool["function"]["parameters"]["properties"].items()}
-		return params
+		return self.schema.get_params(tool_name=tool_name)
 	
 	def get_tool_param_type(self,
 	                        tool_name: str,
 	                        param_name: str) -> Any:
-		tool_schema = self.tools.get_tool_schema()
-		tool_idx = [x["function"]["name"] for x in tool_schema].index(tool_name)
-		tool = tool_schema[tool_idx]
-		t = tool['function']['parameters']['properties'][param_name]['type']
-		if t == 'string': return str
-		elif t == 'integer': return int
-		elif t == 'number': return float
-		else: raise ValueError(f"Unknown type {t}")
+		return self.schema.get_param_type(tool_name=tool_name,
+		                                  param_name=param_name)
 	
 	def trim_and_convert_conversation(self,
-	                                  conversation_history: List[str]) -> List[Dict[str, str]]:
+	                                  conversation_history: List[str],
+	                                  start: Optional[int] = None) -> List[Dict[str, str]]:
+		start = start if start is not None else self.history_cutoff_idx
 		conversation_messages = []
 		if len(conversation_history) > 0:
-			valid_conversation = conversation_history[self.history_cutoff_idx:]
+			valid_conversation = conversation_history[start:]
 			conversation_messages = [
 				{'role': 'user',
-				 'content': f"{'Designer' if (i + self.history_cutoff_idx) % 2 == 0 else 'Colleague'}: {msg}"}
+				 'content': f"{'Designer' if (i + start) % 2 == 0 else 'Colleague'}: {msg}"}
 				for i, msg in enumerate(valid_conversation)
 				]
 		return conversation_messages
 	
+	def compact_history_steps(self,
+	                          conversation_history: List[str]) -> Steps:
+		if self.history is None:
+			return self.trim_and_convert_conversation(conversation_history)
+		def log_summary_call(output: Dict[str, Any],
+		                     elapsed: float) -> None:
+			self.context.logger.write_msg(source='FreyrLLM.compact_history',
+			                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {elapsed:.4f}')
+		
+		with self.context.metrics.stage('FreyrLLM.compact_history'):
+			# The history is sent to the intent and params models, so it is counted with the intent model's tokenizer
+			self.history.count_model = self.cache.get_model_by_role(role='intent')
+			summary, idx = yield from self.history.compact_steps(conversation_history=conversation_history,
+			                                                     start=self.history_cutoff_idx,
+			                                                     summary_request={'model_name': self.cache.get_model_by_role(role='chat')},
+			                                                     on_response=log_summary_call)
+		self.context.logger.write_msg(source='FreyrLLM.compact_history',
+		                              msg=f'Summarised messages: {idx - self.history_cutoff_idx}; Verbatim messages: {len(conversation_history) - idx}; Summaries: {self.history.n_summaries}')
+		return HistoryCompactor.summary_message(summary) + self.trim_and_convert_conversation(conversation_history, start=idx)
+	
 	@staticmethod
 	def convert_for_chat(conversation_messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
 		chat_conversation = []
@@ -207,220 +376,728 @@ class FreyrLLM:
 			chat_conversation.append({'role': role, 'content': content})
 		return chat_conversation
 
-	def extract_intents(self,
-	                    conversation_history: List[Dict[str, str]],
-	                    user_message: str,
-	                    level: Level) -> List[str]:
+	
+	def __level_prompt_args(self,
+	                        level: Level,
+	                        role: str,
+	                        user_message: Optional[str] = None) -> Dict[str, Any]:
+		level_format = self.level_formats[role]
+		if self.level_delta is None:
+			if self.level_view is not None and user_message is not None:
+				return {'level_str': self.level_view.render(level=level, user_message=user_message, level_format=level_format)}
+			return {'level_str': self.level_renderer.render(level=level, level_format=level_format)}
+		# The anchor level is part of the stable prompt, and only the changes since then are sent with each call
+		level_str, level_changes = self.level_delta.render(level=level, level_format=level_format)
+		return {
+			'level_str': level_str,
+			'level_changes': level_changes,
+			'volatile': tuple(section for section in VOLATILE_SECTIONS if section != 'Level')
+		}
+	
+	def __intents_request(self,
+	                      conversation_history: List[Dict[str, str]],
+	                      user_message: str,
+	                      level: Level) -> Tuple[str, List[Dict[str, str]]]:
 		model_name = self.cache.get_model_by_role('intent')
 		prompt = self.cache.get_prompt_by_role('intent')
-		level_str = str(level)
-		intents_str = str(self.intents_dict)
-		prompt = prompt.format(level_str=level_str,
-		                       intents_str=intents_str)
-		messages = [
-			{'role': 'system', 'content': prompt},
-			*conversation_history,
-			{'role': 'user', 'content': f'Designer: {user_message}'}
-		]
-		log_msg = str(messages).replace('\n', '')
-		custom_logger.write_msg(source='FreyrLLM.extract_intents',
-		                        msg=f"messages={log_msg}")
-		start = default_timer()
-		output = self.__chat(model_name=model_name,
-		                     messages=messages)
-		end = default_timer()
-		custom_logger.write_msg(source='FreyrLLM.extract_intents',
-		                        msg = f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
-		response = output['message']['content']
-		custom_logger.write_msg(source='FreyrLLM.extract_intents',
-		                        msg=f"{response=}")
-		intents = FreyrLLM.polish_intents_output(response=response)
-		custom_logger.write_msg(source='FreyrLLM.extract_intents',
-		                        msg=f"{intents=}")
-		return intents
+		messages = build_messages(prompt=prompt,
+		                          history=conversation_history,
+		                          user_content=f'Designer: {user_message}',
+		                          layout=self.prompt_layout,
+		                          intents_str=self.intents_str,
+		                          **self.__level_prompt_args(level=level, role='intent', user_message=user_message))
+		return model_name, messages
 	
-	def generate_params_and_execute_tool(self,
+	def extract_intents_steps(self,
+	                          conversation_history: List[Dict[str, str]],
+	                          user_message: str,
+	                          level: Level) -> Steps:
+		with self.context.metrics.stage('FreyrLLM.extract_intents'):
+			_, messages = self.__intents_request(conversation_history=conversation_history,
+			                                     user_message=user_message,
+			                                     level=level)
+			log_msg = str(messages).replace('\n', '')
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+			                              msg=f"messages={log_msg}")
+			tiers = self.__cascade_tiers(role='intent')
+			for i, model_name in enumerate(tiers):
+				start = default_timer()
+				output = yield {'model_name': model_name, 'messages': messages}
+				end = default_timer()
+				if self.cascade:
+					self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+					                              msg=f'Cascade tier {i + 1}/{len(tiers)}: {model_name=}')
+				self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+				                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+				response = output['message']['content']
+				self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+				                              msg=f"{response=}")
+				intents = FreyrLLM.polish_intents_output(response=response)
+				self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+				                              msg=f"{intents=}")
+				if i < len(tiers) - 1:
+					# Escalate on intents that are not operations
+					escalate = len(intents) == 0 or any(intent not in self.intent_names for intent in intents)
+					self.context.metrics.add_escalation(role='intent', model_name=model_name, escalated=escalate)
+					if not escalate:
+						break
+			return intents
+	
+	def extract_intents_and_params_steps(self,
 	                                     conversation_history: List[Dict[str, str]],
 	                                     user_message: str,
-	                                     intent: str,
-	                                     level: Level) -> str:
-		model_name = self.cache.get_model_by_role('params')
-		prompt = self.cache.get_prompt_by_role('params')
-		level_str = str(level)
-		op_params = self.get_tool_parameters(tool_name=intent)
-		op_params_str = str(op_params)
-		prompt = prompt.format(level_str=level_str,
-		                       operation=intent,
-		                       op_params_str=op_params_str)
-		messages = [
-			{'role': 'system', 'content': prompt},
-			*conversation_history,
-			{'role': 'user', 'content': f'Designer: {user_message}'}
-		]
-		
-		n_retries = 3
-		response = self.PARAM_ERROR_MSG
-		
-		while response == self.PARAM_ERROR_MSG:
+	                                     level: Level) -> Steps:
+		"""
+		Generates the intents and the parameters of each of them with a single call of the intent model, then executes
+		them in order. Returns the intents and the tool results, which are None for conversations and when the response
+		cannot be used as it is (the parameters are then generated for each intent).
+		"""
+		with self.context.metrics.stage('FreyrLLM.extract_intents_and_params'):
+			model_name = self.cache.get_model_by_role('intent')
+			messages = build_messages(prompt=self.intent_params_prompt,
+			                          history=conversation_history,
+			                          user_content=f'Designer: {user_message}',
+			                          layout=self.prompt_layout,
+			                          intents_params_str=self.intents_params_str,
+			                          **self.__level_prompt_args(level=level, role='intent', user_message=user_message))
 			log_msg = str(messages).replace('\n', '')
-			custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-			                        msg=f"{intent=}; messages={log_msg}; {n_retries=}")
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents_and_params',
+			                              msg=f"messages={log_msg}")
 			start = default_timer()
-			output = self.__chat(model_name=model_name,
-			                     messages=messages)
+			output = yield {'model_name': model_name, 'messages': messages}
 			end = default_timer()
-			custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-			                        msg = f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents_and_params',
+			                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
 			response = output['message']['content']
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents_and_params',
+			                              msg=f"{response=}")
+			# The intents are on the first line, the parameter blocks follow
+			intents = FreyrLLM.polish_intents_output(response=response.strip().split('\n', maxsplit=1)[0])
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents_and_params',
+			                              msg=f"{intents=}")
+		
+		if any(intent not in self.intent_names for intent in intents):
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents_and_params',
+			                              msg='Invalid intents; extracting them again')
+			intents = yield from self.extract_intents_steps(conversation_history=conversation_history,
+			                                                user_message=user_message,
+			                                                level=level)
+			return intents, None
+		tool_intents = [intent for intent in intents if intent != 'conversation']
+		if len(intents) == 0 or intents[0] == 'conversation' or len(intents) > 10:
+			return intents, None
+		blocks = FreyrLLM.split_param_blocks(response=response, n_blocks=len(tool_intents))
+		if any(block is None for block in blocks):
+			self.context.logger.write_msg(source='FreyrLLM.extract_intents_and_params',
+			                              msg=f'Parameter blocks: {sum(block is not None for block in blocks)}/{len(tool_intents)}; generating the parameters of each intent')
+			return intents, None
+		tool_results = yield from self.execute_param_blocks_steps(conversation_history=conversation_history,
+		                                                          user_message=user_message,
+		                                                          intents=tool_intents,
+		                                                          blocks=blocks,
+		                                                          level=level)
+		return intents, tool_results
+	
+	def extract_intents(self,
+	                    conversation_history: List[Dict[str, str]],
+	                    user_message: str,
+	                    level: Level) -> List[str]:
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.extract_intents_steps(conversation_history=conversation_history,
+		                                              user_message=user_message,
+		                                              level=level))
+	
+	def extract_intents_and_params(self,
+	                               conversation_history: List[Dict[str, str]],
+	                               user_message: str,
+	                               level: Level) -> Tuple[List[str], Optional[List[str]]]:
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.extract_intents_and_params_steps(conversation_history=conversation_history,
+		                                                         user_message=user_message,
+		                                                         level=level))
+	
+	def generate_params_and_execute_tool_steps(self,
+	                                           conversation_history: List[Dict[str, str]],
+	                                           user_message: str,
+	                                           intent: str,
+	                                           level: Level) -> Steps:
+		with self.context.metrics.stage('FreyrLLM.generate_params_and_execute_tool'):
+			model_name = self.cache.get_model_by_role('params')
+			prompt = self.cache.get_prompt_by_role('params')
+			self.get_tool_parameters(tool_name=intent)  # Fails on intents that are not tools
+			messages = build_messages(prompt=prompt,
+			                          history=conversation_history,
+			                          user_content=f'Designer: {user_message}',
+			                          layout=self.prompt_layout,
+			                          operation=intent,
+			                          op_params_str=self.schema.op_params_str[intent],
+			                          **self.__level_prompt_args(level=level, role='params', user_message=user_message))
 			
-			if self.PARAM_ERROR_MSG in response:  # Some models include multiple '\n' and extra text
-				messages.append({'role': 'assistant', 'content': f'It was not possible to execute {intent}.'})
-				custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-				                        msg="Early termination was triggered.")
-				break
+			# Cheaper models get one attempt each; the role's own model gets the retries with error feedback
+			tiers = self.__cascade_tiers(role='params')
+			for i, tier_model in enumerate(tiers[:-1]):
+				start = default_timer()
+				output = yield {'model_name': tier_model, 'messages': messages}
+				end = default_timer()
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f'Cascade tier {i + 1}/{len(tiers)}: {tier_model=}')
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f'response={output["message"]["content"]}')
+				func_output = self.__try_tool_call(intent=intent,
+				                                   response=output['message']['content'],
+				                                   level=level,
+				                                   source='FreyrLLM.generate_params_and_execute_tool')
+				self.context.metrics.add_escalation(role='params', model_name=tier_model, escalated=func_output is None)
+				if func_output is not None:
+					return func_output
+			
+			n_retries = 3
+			response = self.PARAM_ERROR_MSG
 			
-			custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-			                        msg=f"{response=}; {n_retries=}")
-			messages.append({'role': 'assistant', 'content': response})
+			while response == self.PARAM_ERROR_MSG:
+				log_msg = str(messages).replace('\n', '')
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f"{intent=}; messages={log_msg}; {n_retries=}")
+				start = default_timer()
+				output = yield {'model_name': model_name, 'messages': messages}
+				end = default_timer()
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+				response = output['message']['content']
+				
+				if self.PARAM_ERROR_MSG in response:  # Some models include multiple '\n' and extra text
+					messages.append({'role': 'assistant', 'content': NOT_EXECUTED.format(operation=intent)})
+					self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+					                              msg="Early termination was triggered.")
+					break
+				
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f"{response=}; {n_retries=}")
+				messages.append({'role': 'assistant', 'content': response})
+				
+				tool_args = self.prepare_params_for_tool_call(tool_name=intent,
+				                                              response=response)
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f"{intent=}; {tool_args=}")
+				
+				# try call function
+				func_output = self.tools.try_call_func(func_name=intent,
+				                                       func_args=json.dumps(tool_args),
+				                                       level=level)
+				self.level_renderer.mark_stale()
+				self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+				                              msg=f"{func_output=}")
+				if 'Domain validation error' in func_output or 'Missing arguments' in func_output:
+					func_err_msg = func_output.replace('Domain validation error: ', '').replace('Missing arguments: ', '')
+					messages.append({'role': 'user', 'content': self.feedback_error.format(operation=intent,
+					                                                                       func_err_msg=func_err_msg,
+					                                                                       func_args=str(tool_args),
+					                                                                       err_msg=self.PARAM_ERROR_MSG)})
+					response = self.PARAM_ERROR_MSG
+					if n_retries == 0:
+						err_msg = RETRIES_EXHAUSTED.format(error=func_err_msg)
+						self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+						                              msg=err_msg)
+						return err_msg
+				else:
+					messages.append({'role': 'system', 'content': func_output})
+				n_retries -= 1
+			
+			self.context.logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
+			                              msg=f"final_output={messages[-1]['content']}")
 			
+			return messages[-1]['content']
+	
+	def generate_params_and_execute_tool(self,
+	                                     conversation_history: List[Dict[str, str]],
+	                                     user_message: str,
+	                                     intent: str,
+	                                     level: Level) -> str:
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.generate_params_and_execute_tool_steps(conversation_history=conversation_history,
+		                                                               user_message=user_message,
+		                                                               intent=intent,
+		                                                               level=level))
+	
+	def intent_cache_key(self) -> str:
+		# Cached intents are only reused with the same intent model(s), prompt and mode
+		has_model = self.cache.role_has_model('intent')
+		prompt = self.intent_params_prompt if self.fused_params else self.cache.get_prompt_by_role('intent') if has_model else ''
+		return json.dumps({
+			'models': self.__cascade_tiers(role='intent') if has_model else [],
+			'prompt': hashlib.sha1(f'{prompt}{self.intents_str}'.encode('utf-8')).hexdigest(),
+			'prompt_layout': self.prompt_layout,
+			'level_format': self.level_formats['intent'],
+			'level_delta': self.level_delta is not None,
+			'level_view': self.level_view is not None,
+			'fused_params': self.fused_params
+		}, sort_keys=True)
+	
+	def __cascade_tiers(self,
+	                    role: str) -> List[str]:
+		# The models to try in order: the role's cheaper models first in cascade mode, and its own model last
+		return self.cache.get_cascade_by_role(role) if self.cascade else [self.cache.get_model_by_role(role)]
+	
+	def __try_tool_call(self,
+	                    intent: str,
+	                    response: str,
+	                    level: Level,
+	                    source: str) -> Optional[str]:
+		# Executes the parameters generated for an intent; None if they are malformed or the call fails
+		if self.PARAM_ERROR_MSG in response:
+			return None
+		try:
 			tool_args = self.prepare_params_for_tool_call(tool_name=intent,
 			                                              response=response)
-			custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-			                        msg=f"{intent=}; {tool_args=}")
-			
-			# try call function
-			func_output = self.tools.try_call_func(func_name=intent,
-			                                       func_args=json.dumps(tool_args),
-			                                       level=level)
-			custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-			                        msg=f"{func_output=}")
-			if 'Domain validation error' in func_output or 'Missing arguments' in func_output:
-				func_err_msg = func_output.replace('Domain validation error: ', '').replace('Missing arguments: ', '')
-				messages.append({'role': 'user', 'content': self.feedback_error.format(operation=intent,
-				                                                                       func_err_msg=func_err_msg,
-				                                                                       func_args=str(tool_args),
-				                                                                       err_msg=self.PARAM_ERROR_MSG)})
-				response = self.PARAM_ERROR_MSG
-				if n_retries == 0:
-					err_msg = f"End of retries; failed with {func_err_msg}"
-					custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-					                        msg=err_msg)
-					return err_msg
-			else:
-				messages.append({'role': 'system', 'content': func_output})
-			n_retries -= 1
-		
-		custom_logger.write_msg(source='FreyrLLM.generate_params_and_execute_tool',
-		                        msg=f"final_output={messages[-1]['content']}")
+		except (ValueError, KeyError, TypeError) as e:
+			self.context.logger.write_msg(source=source,
+			                              msg=f'{intent=}; Malformed parameters: {e}')
+			return None
+		func_output = self.tools.try_call_func(func_name=intent,
+		                                       func_args=json.dumps(tool_args),
+		                                       level=level)
+		self.level_renderer.mark_stale()
+		self.context.logger.write_msg(source=source,
+		                              msg=f"{intent=}; {tool_args=}; {func_output=}")
+		if 'Domain validation error' in func_output or 'Missing arguments' in func_output:
+			return None
+		return func_output
+	
+	@staticmethod
+	def split_param_blocks(response: str,
+	                       n_blocks: int) -> List[Optional[str]]:
+		# The parameters listed under each `### <number>. <operation>` heading (None if the block is missing or empty)
+		blocks: List[Optional[str]] = [None] * n_blocks
+		parts = re.split(r'(?m)^\s*#+\s*(\d+)\.?[^\n]*$', response)
+		for number, block in zip(parts[1::2], parts[2::2]):
+			i = int(number) - 1
+			if 0 <= i < n_blocks and blocks[i] is None and block.strip() != '':
+				blocks[i] = block.strip()
+		return blocks
+	
+	def execute_param_blocks_steps(self,
+	                               conversation_history: List[Dict[str, str]],
+	                               user_message: str,
+	                               intents: List[str],
+	                               blocks: List[Optional[str]],
+	                               level: Level) -> Steps:
+		# Executes the parameters generated for each intent in order, falling back to a params call for the failed ones
+		tool_results, n_fallbacks = [], 0
+		for intent, block in zip(intents, blocks):
+			func_output = None
+			if block is not None:
+				func_output = self.__try_tool_call(intent=intent,
+				                                   response=block,
+				                                   level=level,
+				                                   source='FreyrLLM.execute_param_blocks')
+			if func_output is None:
+				n_fallbacks += 1
+				func_output = yield from self.generate_params_and_execute_tool_steps(conversation_history=conversation_history,
+				                                                                     user_message=user_message,
+				                                                                     intent=intent,
+				                                                                     level=level)
+			tool_results.append(func_output)
+			# tool error early break
+			if 'End of retries' in func_output:
+				break
+		self.context.logger.write_msg(source='FreyrLLM.execute_param_blocks',
+		                              msg=f'Generated intents: {len(intents)}; Fallbacks: {n_fallbacks}')
+		return tool_results
+	
+	def generate_batch_params_and_execute_tools_steps(self,
+	                                                  conversation_history: List[Dict[str, str]],
+	                                                  user_message: str,
+	                                                  intents: List[str],
+	                                                  level: Level) -> Steps:
+		"""
+		Generates the parameters of all the intents with a single call, then executes them in order.
+		The intents whose block is missing or malformed, or whose call fails, fall back to
+		`generate_params_and_execute_tool_steps`.
+		"""
+		with self.context.metrics.stage('FreyrLLM.generate_batch_params'):
+			model_name = self.cache.get_model_by_role('params')
+			for intent in intents:
+				self.get_tool_parameters(tool_name=intent)  # Fails on intents that are not tools
+			operations_str = '\n'.join(f'### {i + 1}. {intent}\n{self.schema.op_params_str[intent]}' for i, intent in enumerate(intents))
+			messages = build_messages(prompt=self.params_batch_prompt,
+			                          history=conversation_history,
+			                          user_content=f'Designer: {user_message}',
+			                          layout=self.prompt_layout,
+			                          operations_str=operations_str,
+			                          err_msg=self.PARAM_ERROR_MSG,
+			                          **self.__level_prompt_args(level=level, role='params', user_message=user_message))
+			log_msg = str(messages).replace('\n', '')
+			self.context.logger.write_msg(source='FreyrLLM.generate_batch_params',
+			                              msg=f"{intents=}; messages={log_msg}")
+			start = default_timer()
+			output = yield {'model_name': model_name, 'messages': messages}
+			end = default_timer()
+			self.context.logger.write_msg(source='FreyrLLM.generate_batch_params',
+			                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+			response = output['message']['content']
+			self.context.logger.write_msg(source='FreyrLLM.generate_batch_params',
+			                              msg=f"{response=}")
+			blocks = FreyrLLM.split_param_blocks(response=response, n_blocks=len(intents))
 		
-		return messages[-1]['content']
+		return (yield from self.execute_param_blocks_steps(conversation_history=conversation_history,
+		                                                   user_message=user_message,
+		                                                   intents=intents,
+		                                                   blocks=blocks,
+		                                                   level=level))
+	
+	def generate_batch_params_and_execute_tools(self,
+	                                            conversation_history: List[Dict[str, str]],
+	                                            user_message: str,
+	                                            intents: List[str],
+	                                            level: Level) -> List[str]:
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.generate_batch_params_and_execute_tools_steps(conversation_history=conversation_history,
+		                                                                      user_message=user_message,
+		                                                                      intents=intents,
+		                                                                      level=level))
+	
+	def summarize_tool_results_steps(self,
+	                                 tool_results: List[str],
+	                                 level: Level,
+	                                 intents: Optional[List[str]] = None) -> Steps:
+		# `intents` are the operations that produced `tool_results`, in order (needed for the templates)
+		with self.context.metrics.stage('FreyrLLM.summarize_tool_results'):
+			if self.summary_mode != 'llm':
+				summary, unmatched = render_summary(tool_results=tool_results,
+				                                    operations=intents if intents is not None else [])
+				# Without a summary model, the results no template matched are reported as they are
+				if len(unmatched) == 0 or self.summary_mode == 'templates' or not self.cache.role_has_model('summary'):
+					response = ' '.join([summary, *unmatched]).strip()
+					self.summaries['templates'] += 1
+					self.context.logger.write_msg(source='FreyrLLM.summarize_tool_results',
+					                              msg=f"{response=}; Unmatched: {len(unmatched)}; {self.summaries}")
+					return response
+				self.context.logger.write_msg(source='FreyrLLM.summarize_tool_results',
+				                              msg=f'No template for {unmatched=}')
+			self.summaries['llm'] += 1
+			model_name = self.cache.get_model_by_role('summary')
+			prompt = self.cache.get_prompt_by_role('summary')
+			tool_results_str = '; '.join(tool_results)
+			messages = build_messages(prompt=prompt,
+			                          history=[],
+			                          user_content=tool_results_str,
+			                          layout=self.prompt_layout,
+			                          **self.__level_prompt_args(level=level, role='summary'))
+			log_msg = str(messages).replace('\n', '')
+			self.context.logger.write_msg(source='FreyrLLM.summarize_tool_results',
+			                              msg=f"messages={log_msg}")
+			start = default_timer()
+			output = yield {'model_name': model_name, 'messages': messages}
+			end = default_timer()
+			self.context.logger.write_msg(source='FreyrLLM.summarize_tool_results',
+			                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+			response = output['message']['content']
+			self.context.logger.write_msg(source='FreyrLLM.summarize_tool_results',
+			                              msg=f"{response=}")
+			return response
 	
 	def summarize_tool_results(self,
 	                           tool_results: List[str],
-	                           level: Level) -> str:
-		model_name = self.cache.get_model_by_role('summary')
-		prompt = self.cache.get_prompt_by_role('summary')
-		level_str = str(level)
-		tool_results_str = '; '.join(tool_results)
-		prompt = prompt.format(level_str=level_str)
-		messages = [
-			{'role': 'system', 'content': prompt},
-			{'role': 'user', 'content': tool_results_str},
-		]
-		log_msg = str(messages).replace('\n', '')
-		custom_logger.write_msg(source='FreyrLLM.summarize_tool_results',
-		                        msg=f"messages={log_msg}")
-		start = default_timer()
-		output = self.__chat(model_name=model_name,
-		                     messages=messages)
-		end = default_timer()
-		custom_logger.write_msg(source='FreyrLLM.summarize_tool_results',
-		                        msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
-		response = output['message']['content']
-		custom_logger.write_msg(source='FreyrLLM.summarize_tool_results',
-		                        msg=f"{response=}")
-		return response
+	                           level: Level,
+	                           intents: Optional[List[str]] = None) -> str:
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.summarize_tool_results_steps(tool_results=tool_results,
+		                                                     level=level,
+		                                                     intents=intents))
+	
+	def chat_steps(self,
+	               conversation_history: List[Dict[str, str]],
+	               user_message: str,
+	               level: Level) -> Steps:
+		with self.context.metrics.stage('FreyrLLM.chat'):
+			chat_conversation = FreyrLLM.convert_for_chat(conversation_messages=conversation_history)
+			model_name = self.cache.get_model_by_role('chat')
+			prompt = self.cache.get_prompt_by_role('chat')
+			messages = build_messages(prompt=prompt,
+			                          history=chat_conversation,
+			                          user_content=user_message,
+			                          layout=self.prompt_layout,
+			                          **self.__level_prompt_args(level=level, role='chat'))
+			log_msg = str(messages).replace('\n', '')
+			self.context.logger.write_msg(source='FreyrLLM.chat',
+			                              msg=f"messages={log_msg}")
+			start = default_timer()
+			output = yield {'model_name': model_name, 'messages': messages}
+			end = default_timer()
+			self.context.logger.write_msg(source='FreyrLLM.chat',
+			                              msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
+			response = output['message']['content']
+			self.context.logger.write_msg(source='FreyrLLM.chat',
+			                              msg=f"{response=}")
+			return response
 	
 	def chat(self,
 	         conversation_history: List[Dict[str, str]],
 	         user_message: str,
 	         level: Level) -> str:
-		chat_conversation = FreyrLLM.convert_for_chat(conversation_messages=conversation_history)
-		model_name = self.cache.get_model_by_role('chat')
-		prompt = self.cache.get_prompt_by_role('chat')
-		level_str = str(level)
-		prompt = prompt.format(level_str=level_str)
-		messages = [
-			{'role': 'system', 'content': prompt},
-			*chat_conversation,
-			{'role': 'user', 'content': user_message}
-		]
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.chat_steps(conversation_history=conversation_history,
+		                                   user_message=user_message,
+		                                   level=level))
+	
+	def stream_intents_and_tool_calls_steps(self,
+	                                        conversation_history: List[Dict[str, str]],
+	                                        user_message: str,
+	                                        level: Level) -> Steps:
+		# Pipelined extract_intents and generate_params_and_execute_tool: the parameters of each intent are generated
+		# while the following intents are still being decoded
+		model_name, messages = self.__intents_request(conversation_history=conversation_history,
+		                                              user_message=user_message,
+		                                              level=level)
 		log_msg = str(messages).replace('\n', '')
-		custom_logger.write_msg(source='FreyrLLM.chat',
-		                        msg=f"messages={log_msg}")
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f"messages={log_msg}; stream=True")
 		start = default_timer()
-		output = self.__chat(model_name=model_name,
-		                     messages=messages)
-		end = default_timer()
-		custom_logger.write_msg(source='FreyrLLM.chat',
-		                        msg=f'Prompt Tokens: {output["prompt_eval_count"]}; Completion Tokens: {output["eval_count"]}; Time: {(end - start):.4f}')
-		response = output['message']['content']
-		custom_logger.write_msg(source='FreyrLLM.chat',
-		                        msg=f"{response=}")
-		return response
+		stream = yield {'model_name': model_name, 'messages': messages, 'stream': True}
+		parser = IntentsStreamParser()
+		intents, tool_results = [], []
+		dispatch = True
+		original_level = level.model_copy(deep=True)  # The tools run before all the intents are known
+		try:
+			while not parser.done:
+				chunk = yield {'next_chunk': stream}
+				for intent in parser.feed(chunk):
+					intents.append(intent)
+					self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+					                              msg=f'{intent=}; Time: {(default_timer() - start):.4f}')
+					if len(intents) > 10:
+						# Same as the non-streamed intents: the turn is aborted without changing the level
+						FreyrLLM.copy_level(src=original_level,
+						                    dst=level)
+						raise ValueError(f'Too many intents were generated ({len(intents)}); aborting...')
+					# Conversation only gets a chat once the intents are complete; no tool is called after a failed one
+					if intents[0] == 'conversation' or intent == 'conversation' or not dispatch:
+						continue
+					self.context.logger.write_msg(source='FreyrLLM',
+					                              msg=f'Starting processing {intent=}')
+					output = yield from self.generate_params_and_execute_tool_steps(conversation_history=conversation_history,
+					                                                                user_message=user_message,
+					                                                                intent=intent,
+					                                                                level=level)
+					tool_results.append(output)
+					self.context.logger.write_msg(source='FreyrLLM',
+					                              msg=f'{tool_results=}')
+					dispatch = 'End of retries' not in output
+		finally:
+			# Stops decoding on the server if the model rambles after the list of intents
+			stream.close()
+			self._stream_done(stream=stream,
+			                  stage='FreyrLLM.extract_intents')
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f'Prompt Tokens: {FreyrLLM.stream_prompt_tokens(stream)}; Completion Tokens: {stream.output.get("eval_count", stream.n_chunks)}; Time: {stream.elapsed:.4f}')
+		response = parser.text
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f"{response=}")
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f"{intents=}")
+		return intents, tool_results
+	
+	@staticmethod
+	def copy_level(src: Level,
+	               dst: Level) -> None:
+		# In place, since the caller holds a reference to the level
+		for name in type(dst).model_fields:
+			setattr(dst, name, getattr(src, name))
+	
+	def speculative_intents_and_tool_calls_steps(self,
+	                                             conversation_history: List[Dict[str, str]],
+	                                             user_message: str,
+	                                             level: Level) -> Steps:
+		"""
+		Sends the intents request to the intent model, streamed in the background, and to the (faster) draft model.
+		If the draft answers first with valid intents, their tools are executed on a copy of the level while the intent
+		model is still decoding. The copy replaces the level if both models agree on the intents, and is dropped
+		otherwise. Returns the intents and the tool results (None if the draft was not used).
+		"""
+		model_name, messages = self.__intents_request(conversation_history=conversation_history,
+		                                              user_message=user_message,
+		                                              level=level)
+		log_msg = str(messages).replace('\n', '')
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f"messages={log_msg}; speculative=True")
+		stream = yield {'model_name': model_name, 'messages': messages, 'stream': True}
+		parser = IntentsStreamParser()
+		draft_level, draft_results = None, None
+		try:
+			with self.context.metrics.stage('FreyrLLM.extract_draft_intents'):
+				try:
+					start = default_timer()
+					draft_output = yield {'model_name': self.draft_model, 'messages': messages}
+					end = default_timer()
+					self.context.logger.write_msg(source='FreyrLLM.extract_draft_intents',
+					                              msg=f'Prompt Tokens: {draft_output["prompt_eval_count"]}; Completion Tokens: {draft_output["eval_count"]}; Time: {(end - start):.4f}')
+					draft_intents = FreyrLLM.polish_intents_output(response=draft_output['message']['content'])
+				except (ollama.ResponseError, CassetteMissError, ConnectionError) as e:
+					# e.g. the draft model is not in the cassette; the intents then come from the intent model only
+					self.context.logger.write_msg(source='FreyrLLM.extract_draft_intents',
+					                              msg=f'Exception: {e}')
+					draft_intents = []
+			draft_end = default_timer()
+			self.context.logger.write_msg(source='FreyrLLM.extract_draft_intents',
+			                              msg=f'{draft_intents=}; intent model done: {stream.finished_at is not None}')
+			valid = 0 < len(draft_intents) <= 10 and all(intent in self.intent_names for intent in draft_intents)
+			if valid and draft_intents[0] != 'conversation' and stream.finished_at is None:
+				draft_level, draft_results = level.model_copy(deep=True), []
+				for intent in draft_intents:
+					if intent == 'conversation':
+						continue
+					output = yield from self.generate_params_and_execute_tool_steps(conversation_history=conversation_history,
+					                                                                user_message=user_message,
+					                                                                intent=intent,
+					                                                                level=draft_level)
+					draft_results.append(output)
+					if 'End of retries' in output:
+						break
+			params_end = default_timer()
+			while not parser.done:
+				parser.feed((yield {'next_chunk': stream}))
+			intents_end = stream.finished_at if stream.finished_at is not None else default_timer()
+		finally:
+			stream.close()
+			self._stream_done(stream=stream,
+			                  stage='FreyrLLM.extract_intents')
+		intents = FreyrLLM.polish_intents_output(response=parser.text)
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f'Prompt Tokens: {FreyrLLM.stream_prompt_tokens(stream)}; Completion Tokens: {stream.output.get("eval_count", stream.n_chunks)}; Time: {stream.elapsed:.4f}')
+		self.context.logger.write_msg(source='FreyrLLM.extract_intents',
+		                              msg=f"{intents=}")
+		
+		if draft_level is None:
+			self.speculations['skipped'] += 1
+			self.context.logger.write_msg(source='FreyrLLM.speculation',
+			                              msg=f'Skipped; {self.speculations}')
+			return intents, None
+		# The tools ran while the intent model decoded (until it finished, or until they were done)
+		overlap = min(intents_end, params_end) - draft_end
+		if intents == draft_intents:
+			self.speculations['accepted'] += 1
+			FreyrLLM.copy_level(src=draft_level, dst=level)
+			self.level_renderer.mark_stale()
+			self.context.logger.write_msg(source='FreyrLLM.speculation',
+			                              msg=f'Accepted; Saved: {overlap:.4f}; {self.speculations}')
+			return intents, draft_results
+		self.speculations['rejected'] += 1
+		self.context.logger.write_msg(source='FreyrLLM.speculation',
+		                              msg=f'Rejected ({draft_intents=}); Lost: {max(0.0, params_end - intents_end):.4f}; {self.speculations}')
+		return intents, None
+	
+	def call_steps(self,
+	               user_message: str,
+	               conversation_history: List[str],
+	               level: Level) -> Steps:
+		with self.context.metrics.stage('FreyrLLM.__call__'):
+			start = default_timer()
+			self.context.logger.write_msg(source='FreyrLLM',
+			                              msg=f'History cutoff: {self.history_cutoff_idx}; Conversation length: {len(conversation_history)}')
+			self.level_renderer.mark_stale()  # The level may have been changed since the last turn
+			valid_conversation_history = yield from self.compact_history_steps(conversation_history)
+			
+			cached_intents = self.intent_cache.lookup(user_message) if self.intent_cache is not None else None
+			self.intents_from_cache = cached_intents is not None
+			if self.intents_from_cache:
+				self.context.logger.write_msg(source='FreyrLLM',
+				                              msg=f'Intents from cache: {cached_intents}; {self.intent_cache}')
+				intents, tool_results = cached_intents, None
+			elif self.fused_params:
+				intents, tool_results = yield from self.extract_intents_and_params_steps(conversation_history=valid_conversation_history,
+				                                                                         user_message=user_message,
+				                                                                         level=level)
+			elif self.speculative:
+				intents, tool_results = yield from self.speculative_intents_and_tool_calls_steps(conversation_history=valid_conversation_history,
+				                                                                                 user_message=user_message,
+				                                                                                 level=level)
+			elif self.stream_intents:
+				intents, tool_results = yield from self.stream_intents_and_tool_calls_steps(conversation_history=valid_conversation_history,
+				                                                                            user_message=user_message,
+				                                                                            level=level)
+			else:
+				intents = yield from self.extract_intents_steps(conversation_history=valid_conversation_history,
+				                                                user_message=user_message,
+				                                                level=level)
+				tool_results = None
+			
+			self.intents = intents
+			if self.intent_cache is not None and not self.intents_from_cache and 0 < len(intents) <= 10 and all(intent in self.intent_names for intent in intents):
+				self.intent_cache.add(message=user_message, intents=intents)
+			
+			if len(intents) > 10:
+				raise ValueError(f'Too many intents were generated ({len(intents)}); aborting...')
+			
+			if intents[0] == 'conversation':
+				# Chat only
+				self.context.logger.write_msg(source='FreyrLLM',
+				                              msg='Chat only')
+				response = yield from self.chat_steps(conversation_history=valid_conversation_history,
+				                                      user_message=user_message,
+				                                      level=level)
+			else:
+				# process and collect result for each intent operation
+				self.context.logger.write_msg(source='FreyrLLM',
+				                              msg='Tool call')
+				tool_intents = [intent for intent in intents if intent != 'conversation']
+				if tool_results is None and self.batch_params and len(tool_intents) > 1:
+					tool_results = yield from self.generate_batch_params_and_execute_tools_steps(conversation_history=valid_conversation_history,
+					                                                                             user_message=user_message,
+					                                                                             intents=tool_intents,
+					                                                                             level=level)
+				if tool_results is None:
+					tool_results = []
+					for intent in intents:
+						if intent != 'conversation':  # Some models may include conversation *as last intent*, but we can just skip it
+							self.context.logger.write_msg(source='FreyrLLM',
+							                              msg=f'Starting processing {intent=}')
+							output = yield from self.generate_params_and_execute_tool_steps(conversation_history=valid_conversation_history,
+							                                                                user_message=user_message,
+							                                                                intent=intent,
+							                                                                level=level)
+							tool_results.append(output)
+							self.context.logger.write_msg(source='FreyrLLM',
+							                              msg=f'{tool_results=}')
+							
+							# tool error early break
+							if 'End of retries' in output:
+								break
+							
+				# update history cutoff
+				self.history_cutoff_idx = len(conversation_history) + 2  # user query + response
+				# summarize results
+				response = yield from self.summarize_tool_results_steps(tool_results=tool_results,
+				                                                        level=level,
+				                                                        intents=tool_intents)
+			end = default_timer()
+			self.context.logger.write_msg(source='FreyrLLM',
+			                              msg=f'Level renders: {self.level_renderer.hits} cached, {self.level_renderer.misses} rendered' +
+			                                  (f'; Level delta refreshes: {self.level_delta.n_refreshes}' if self.level_delta is not None else '') +
+			                                  f'; Compacted prompts: {self.prompt_guard.n_compacted}')
+			if self.response_cache is not None:
+				self.context.logger.write_msg(source='FreyrLLM',
+				                              msg=str(self.response_cache))
+			if self.cascade:
+				self.context.logger.write_msg(source='FreyrLLM',
+				                              msg=f'Escalations: {self.context.metrics.escalation_summary()}')
+			self.context.logger.write_msg(source='FreyrLLM',
+			                              msg=f'Time: {(end - start):.4f}')
+			return response
 	
 	def __call__(self,
 	             user_message: str,
 	             conversation_history: List[str],
 	             level: Level) -> str:
-		start = default_timer()
-		custom_logger.write_msg(source='FreyrLLM',
-		                        msg=f'History cutoff: {self.history_cutoff_idx}; Conversation length: {len(conversation_history)}')
-		valid_conversation_history = self.trim_and_convert_conversation(conversation_history)
-		
-		intents = self.extract_intents(conversation_history=valid_conversation_history,
-		                               user_message=user_message,
-		                               level=level)
-		
-		self.intents = intents
-		
-		if len(intents) > 10:
-			raise ValueError(f'Too many intents were generated ({len(intents)}); aborting...')
-		
-		if intents[0] == 'conversation':
-			# Chat only
-			custom_logger.write_msg(source='FreyrLLM',
-			                        msg='Chat only')
-			response = self.chat(conversation_history=valid_conversation_history,
-			                     user_message=user_message,
-			                     level=level)
-		else:
-			# process and collect result for each intent operation
-			custom_logger.write_msg(source='FreyrLLM',
-			                        msg='Tool call')
-			tool_results = []
-			for intent in intents:
-				if intent != 'conversation':  # Some models may include conversation *as last intent*, but we can just skip it
-					custom_logger.write_msg(source='FreyrLLM',
-					                        msg=f'Starting processing {intent=}')
-					output = self.generate_params_and_execute_tool(conversation_history=valid_conversation_history,
-					                                               user_message=user_message,
-					                                               intent=intent,
-					                                               level=level)
-					tool_results.append(output)
-					custom_logger.write_msg(source='FreyrLLM',
-					                        msg=f'{tool_results=}')
-					
-					# tool error early break
-					if 'End of retries' in output:
-						break
-					
-			# update history cutoff
-			self.history_cutoff_idx = len(conversation_history) + 2  # user query + response
-			# summarize results
-			response = self.summarize_tool_results(tool_results=tool_results,
-			                                       level=level)
-		end = default_timer()
-		custom_logger.write_msg(source='FreyrLLM',
-		                        msg=f'Time: {(end - start):.4f}')
-		return response
+		return drive(chat=self.__chat,
+		             stream=self.__stream,
+		             steps=self.call_steps(user_message=user_message,
+		                                   conversation_history=conversation_history,
+		                                   level=level))
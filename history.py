@@ -0,0 +1,93 @@
+from timeit import default_timer
+from typing import Any, Callable, Dict, List, Optional
+
+from configs import config
+from llm_steps import Steps
+from tokens import count_tokens
+
+
+class HistoryCompactor:
+	"""
+	Keeps the conversation history sent with each call within a token budget.
+	When the messages that are not summarised yet exceed `budget` tokens, the oldest of them are folded into a
+	rolling summary, keeping the most recent `keep_ratio` of the budget verbatim. The summary is cached and sent in
+	place of the messages it covers, so it only needs to be generated again the next time the budget is exceeded.
+	"""
+	def __init__(self,
+	             budget: int = 2048,
+	             keep_ratio: float = 0.5,
+	             count_model: Optional[str] = None):
+		assert 0 < keep_ratio < 1, f'keep_ratio must be in (0, 1), not {keep_ratio}'
+		self.budget = budget
+		self.keep_ratio = keep_ratio
+		self.count_model = count_model  # Tokenizer used to count the history (see `tokens.get_tokenizer`)
+		self.n_summaries = 0
+		with open(config.llm.history.prompt, 'r') as f:
+			self.prompt = f.read()
+		self.__summary = ''
+		self.__span = (0, 0)  # The messages covered by the summary
+	
+	def __count(self,
+	            messages: List[str]) -> int:
+		return sum(count_tokens(msg, model_name=self.count_model) for msg in messages)
+	
+	def compact_steps(self,
+	                  conversation_history: List[str],
+	                  start: int = 0,
+	                  summary_request: Optional[Dict[str, str]] = None,
+	                  on_response: Optional[Callable[[Dict[str, Any], float], None]] = None) -> Steps:
+		"""
+		Returns the summary of `conversation_history[start:idx]` and `idx`, from which the messages are sent verbatim.
+		`summary_request` holds the extra arguments of the summarisation call (e.g. the model to use), and
+		`on_response` is called with its response and duration (e.g. to log them).
+		"""
+		span_start, span_end = self.__span
+		if span_start != start or span_end > len(conversation_history):
+			# A different (or restarted) conversation
+			self.__summary, self.__span = '', (start, start)
+			span_end = start
+		summary_tokens = count_tokens(self.__summary, model_name=self.count_model)
+		if summary_tokens + self.__count(conversation_history[span_end:]) <= self.budget:
+			return self.__summary, span_end
+		
+		# Keep the most recent messages that fit in the budget left to them, and at least the last one
+		idx, kept_tokens = len(conversation_history) - 1, self.__count(conversation_history[-1:])
+		while idx > span_end and kept_tokens + count_tokens(conversation_history[idx - 1], model_name=self.count_model) <= self.keep_ratio * self.budget:
+			idx -= 1
+			kept_tokens += count_tokens(conversation_history[idx], model_name=self.count_model)
+		if idx == span_end:
+			return self.__summary, span_end
+		
+		transcript = '\n'.join(f"{'Designer' if i % 2 == 0 else 'Colleague'}: {msg}"
+		                       for i, msg in enumerate(conversation_history[span_end:idx], start=span_end))
+		messages = [
+			{'role': 'system', 'content': self.prompt},
+			{'role': 'user', 'content': f'Summary so far: {self.__summary or "(none)"}\n\nConversation:\n{transcript}'}
+		]
+		start = default_timer()
+		response = yield {**(summary_request or {}), 'messages': messages}
+		if on_response is not None:
+			on_response(response, default_timer() - start)
+		summary = response['message']['content'].strip()
+		if summary == '':
+			return self.__summary, span_end  # Better a longer prompt than a lost conversation
+		self.n_summaries += 1
+		self.__summary, self.__span = summary, (start, idx)
+		return self.__summary, idx
+	
+	@staticmethod
+	def summary_message(summary: str) -> List[Dict[str, str]]:
+		# The summary stands in for the older messages at the start of the history
+		if summary == '':
+			return []
+		return [{'role': 'user', 'content': f'Summary of the earlier conversation: {summary}'}]
+
+
+def get_history_compactor(count_model: Optional[str] = None,
+                          enabled: Optional[bool] = None) -> Optional[HistoryCompactor]:
+	enabled = enabled if enabled is not None else config.llm.history.enabled
+	if not enabled:
+		return None
+	return HistoryCompactor(budget=config.llm.history.budget,
+	                        keep_ratio=config.llm.history.keep_ratio,
+	                        count_model=count_model)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from configs import config
+
+
+class IntentCache:
+	"""
+	Nearest-neighbour cache of the intents extracted from past user messages.
+	Messages are embedded as L2-normalised counts of their character n-grams, hashed into `dim` buckets, so the
+	cosine similarity with every cached message is a single matrix-vector product. A message whose nearest neighbour
+	is at least `threshold` similar gets that neighbour's intents without calling the intent model.
+	At most `max_size` messages are kept, evicting the least recently used, and the cache can be saved to `fname`.
+	Intents depend on the model, prompt and mode that extracted them, so `key` identifies them: a cache is only
+	loaded from a file saved with the same key.
+	"""
+	def __init__(self,
+	             key: str = '',
+	             threshold: float = 0.9,
+	             max_size: int = 2048,
+	             ngram: int = 3,
+	             dim: int = 512,
+	             fname: Optional[str] = None):
+		self.key = key
+		self.threshold = threshold
+		self.max_size = max_size
+		self.ngram = ngram
+		self.dim = dim
+		self.fname = fname
+		self.hits = 0
+		self.misses = 0
+		self.correct_hits = 0  # Hits whose intents passed `validate_intents`
+		self.checked_hits = 0
+		self.__lock = threading.Lock()
+		self.__vectors = np.zeros((max_size, dim), dtype=np.float32)
+		self.__last_used = np.zeros(max_size, dtype=np.int64)
+		self.__messages: List[str] = []
+		self.__intents: List[List[str]] = []
+		self.__clock = 0
+		if self.fname is not None and os.path.exists(self.fname):
+			self.load()
+	
+	def __len__(self) -> int:
+		return len(self.__messages)
+	
+	def embed(self,
+	          message: str) -> np.ndarray:
+		text = f" {' '.join(message.lower().split())} "
+		vector = np.zeros(self.dim, dtype=np.float32)
+		for i in range(max(1, len(text) - self.ngram + 1)):
+			vector[zlib.crc32(text[i:i + self.ngram].encode('utf-8')) % self.dim] += 1.0
+		return vector / np.linalg.norm(vector)
+	
+	def __nearest(self,
+	              vector: np.ndarray) -> Tuple[int, float]:
+		if len(self) == 0:
+			return -1, 0.0
+		similarities = self.__vectors[:len(self)] @ vector
+		i = int(np.argmax(similarities))
+		return i, float(similarities[i])
+	
+	def lookup(self,
+	           message: str) -> Optional[List[str]]:
+		vector = self.embed(message)
+		with self.__lock:
+			i, similarity = self.__nearest(vector)
+			if i == -1 or similarity < self.threshold:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.__clock += 1
+			self.__last_used[i] = self.__clock
+			return list(self.__intents[i])
+	
+	def add(self,
+	        message: str,
+	        intents: List[str]) -> None:
+		vector = self.embed(message)
+		with self.__lock:
+			self.__clock += 1
+			i, similarity = self.__nearest(vector)
+			if i == -1 or similarity < 1.0 - 1e-6:
+				if len(self) < self.max_size:
+					i = len(self)
+					self.__messages.append(message)
+					self.__intents.append(intents)
+				else:
+					i = int(np.argmin(self.__last_used))  # Least recently used
+					self.__messages[i] = message
+					self.__intents[i] = intents
+				self.__vectors[i] = vector
+			else:
+				self.__intents[i] = intents  # Same message: keep the latest intents
+			self.__last_used[i] = self.__clock
+	
+	def add_outcome(self,
+	                correct: bool) -> None:
+		# Whether the intents of a hit were the expected ones
+		with self.__lock:
+			self.checked_hits += 1
+			self.correct_hits += int(correct)
+	
+	def save(self) -> None:
+		if self.fname is None:
+			return
+		with self.__lock:
+			os.makedirs(os.path.dirname(self.fname) or '.', exist_ok=True)
+			with open(f'{self.fname}.tmp', 'wb') as f:
+				np.savez_compressed(f,
+				                    vectors=self.__vectors[:len(self)],
+				                    last_used=self.__last_used[:len(self)],
+				                    messages=np.array(self.__messages, dtype=str),
+				                    intents=np.array([json.dumps(intents) for intents in self.__intents], dtype=str),
+				                    params=np.array([self.ngram, self.dim]),
+				                    key=np.array(self.key))
+			os.replace(f'{self.fname}.tmp', self.fname)
+	
+	def load(self) -> None:
+		with np.load(self.fname) as data:
+			if 'key' not in data.files or str(data['key']) != self.key:
+				return  # Extracted by another model, prompt or mode; start over
+			if tuple(data['params']) != (self.ngram, self.dim):
+				return  # Embedded differently; start over
+			# The most recently used entries are kept if the cache was saved with a larger max_size
+			order = np.argsort(data['last_used'])[::-1][:self.max_size][::-1]
+			with self.__lock:
+				n = len(order)
+				self.__vectors[:n] = data['vectors'][order]
+				self.__last_used[:n] = np.arange(1, n + 1)
+				self.__messages = [str(data['messages'][i]) for i in order]
+				self.__intents = [json.loads(str(data['intents'][i])) for i in order]
+				self.__clock = n
+	
+	def __str__(self) -> str:
+		hit_rate = self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else float('nan')
+		accuracy = self.correct_hits / self.checked_hits if self.checked_hits > 0 else float('nan')
+		return (f'IntentCache(size={len(self)}, hits={self.hits}, misses={self.misses}, hit_rate={hit_rate:.1%}, '
+		        f'hit_accuracy={accuracy:.1%} over {self.checked_hits} checked)')
+
+
+@lru_cache(maxsize=None)
+def shared_intent_cache(key: str) -> IntentCache:
+	# One cache per process and key (see FreyrLLM.intent_cache_key), shared by all the LLMs (and the workers of a sweep)
+	fname = None
+	if config.llm.intent_cache.persist:
+		fname = os.path.join(config.llm.intent_cache.dir, f'{hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]}.npz')
+	return IntentCache(key=key,
+	                   threshold=config.llm.intent_cache.threshold,
+	                   max_size=config.llm.intent_cache.max_size,
+	                   ngram=config.llm.intent_cache.ngram,
+	                   dim=config.llm.intent_cache.dim,
+	                   fname=fname)
+
+
+def get_intent_cache(key: str,
+                     enabled: Optional[bool] = None) -> Optional[IntentCache]:
+	enabled = enabled if enabled is not None else config.llm.intent_cache.enabled
+	return shared_intent_cache(key) if enabled else None
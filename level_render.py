@@ -0,0 +1,268 @@
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dungeon_despair.domain.level import Level
+from dungeon_despair.domain.utils import get_encounter
+
+
+HIDDEN_FIELDS = ('sprite', 'image')  # Rendering assets rather than design information
+NAMED_MAPS = ('rooms', 'corridors')  # Fields mapping the names of objects to the objects
+
+
+def compact_scalar(value: Any) -> str:
+	if isinstance(value, float):
+		return f'{value:g}'
+	return ' '.join(str(value).split())
+
+
+def compact_lines(label: str,
+                  value: Dict[str, Any],
+                  indent: str = '') -> List[str]:
+	# One `label: key=value; ...` line per object, followed by its nested objects one level of indentation deeper
+	scalars, children = [], []
+	for k, v in value.items():
+		if any(hidden in k for hidden in HIDDEN_FIELDS) or v is None or v == '' or v == [] or v == {} or k == 'name':
+			continue
+		(children if isinstance(v, (dict, list)) else scalars).append((k, v))
+	lines = [f'{indent}{label}' + (f": {'; '.join(f'{k}={compact_scalar(v)}' for k, v in scalars)}" if scalars else '')]
+	for k, v in children:
+		singular = k[:-1] if k.endswith('s') else k
+		if isinstance(v, list):
+			for i, item in enumerate(v):
+				if isinstance(item, dict):
+					lines.extend(compact_lines(label=f"{singular} {item.get('name', i)}", value=item, indent=f'{indent}  '))
+				else:
+					lines.append(f'{indent}  {singular} {i}: {compact_scalar(item)}')
+		elif all(isinstance(item, list) for item in v.values()):
+			# Lists grouped by kind, e.g. the enemies, traps and treasures of an encounter
+			for kind, items in v.items():
+				for i, item in enumerate(items):
+					if isinstance(item, dict):
+						lines.extend(compact_lines(label=f"{kind} {item.get('name', i)}", value=item, indent=f'{indent}  '))
+					else:
+						lines.append(f'{indent}  {kind}: {compact_scalar(item)}')
+		elif k in NAMED_MAPS:
+			for name, item in v.items():
+				lines.extend(compact_lines(label=f'{singular} {name}', value=item, indent=f'{indent}  '))
+		else:
+			lines.extend(compact_lines(label=k, value=v, indent=f'{indent}  '))
+	return lines
+
+
+def compact_level(level: Level) -> str:
+	"""
+	Minified key/value rendering of a level: one line per room, corridor, cell and entity, without prose and
+	without empty fields.
+	"""
+	return '\n'.join(compact_lines(label='level', value=level.model_dump(mode='json')))
+
+
+LEVEL_FORMATS = {
+	'prose': str,
+	'compact': compact_level
+}
+
+
+class LevelRenderer:
+	"""
+	Caches the rendering of a level (see LEVEL_FORMATS) for the prompts of a turn.
+	Once marked stale (e.g. after a tool call), the level is fingerprinted with `model_dump_json`, which is much
+	cheaper than rendering it, and only rendered again if its content actually changed.
+	"""
+	def __init__(self):
+		self.hits = 0
+		self.misses = 0
+		self.__level: Optional[Level] = None  # Holding a reference also keeps its id from being reused
+		self.__fingerprint: Optional[str] = None
+		self.__level_strs: Dict[str, str] = {}
+		self.__stale = True
+	
+	def mark_stale(self) -> None:
+		self.__stale = True
+	
+	def fingerprint(self,
+	                level: Level) -> str:
+		# The `model_dump_json` of the level, only dumped again if it was marked stale or is a different level
+		if level is not self.__level or self.__stale:
+			fingerprint = level.model_dump_json()
+			self.__stale = False
+			if level is not self.__level or fingerprint != self.__fingerprint:
+				self.__level = level
+				self.__fingerprint = fingerprint
+				self.__level_strs = {}
+		return self.__fingerprint
+	
+	def render(self,
+	           level: Level,
+	           level_format: str = 'prose') -> str:
+		self.fingerprint(level)
+		if level_format in self.__level_strs:
+			self.hits += 1
+		else:
+			self.misses += 1
+			self.__level_strs[level_format] = LEVEL_FORMATS[level_format](level)
+		return self.__level_strs[level_format]
+
+
+def compact_json(value: Any) -> str:
+	return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def diff_dumps(old: Any,
+               new: Any,
+               path: str = '') -> List[str]:
+	# One line per added (+), removed (-) or updated (~) field between two `model_dump`s, e.g. `~ rooms.Hall.name: "Hall"`
+	if isinstance(old, dict) and isinstance(new, dict):
+		lines = [f'- {path}{k}' for k in old if k not in new]
+		for k, v in new.items():
+			if k not in old:
+				lines.append(f'+ {path}{k}: {compact_json(v)}')
+			else:
+				lines.extend(diff_dumps(old=old[k], new=v, path=f'{path}{k}.'))
+		return lines
+	if isinstance(old, list) and isinstance(new, list):
+		lines = []
+		for i in range(max(len(old), len(new))):
+			if i >= len(new):
+				lines.append(f'- {path}{i}')
+			elif i >= len(old):
+				lines.append(f'+ {path}{i}: {compact_json(new[i])}')
+			else:
+				lines.extend(diff_dumps(old=old[i], new=new[i], path=f'{path}{i}.'))
+		return lines
+	if old != new:
+		return [f'~ {path.rstrip(".")}: {compact_json(new)}']
+	return []
+
+
+class LevelDeltaRenderer:
+	"""
+	Renders the level of a conversation as an anchor, i.e. the full level as it was the first time it was rendered,
+	plus the changes made to it since. The anchor stays the same across turns, so prompts that start with it keep
+	a stable prefix; it is moved to the current level once the changes are larger than `refresh_ratio` of it.
+	The current level is fingerprinted by `renderer`, so it is only dumped again after it was marked stale.
+	"""
+	def __init__(self,
+	             renderer: LevelRenderer,
+	             refresh_ratio: float = 0.5):
+		self.renderer = renderer
+		self.refresh_ratio = refresh_ratio
+		self.n_refreshes = 0
+		self.__anchor_dump: Optional[Any] = None
+		self.__anchor_level: Optional[Level] = None
+		self.__anchor_renderer: Optional[LevelRenderer] = None
+		self.__last_json: Optional[str] = None
+		self.__last_changes = ''
+	
+	def __set_anchor(self,
+	                 level: Level,
+	                 level_json: str) -> None:
+		self.__anchor_dump = json.loads(level_json)
+		self.__anchor_level = level.model_copy(deep=True)  # Later renders in other formats must see the level as it was
+		self.__anchor_renderer = LevelRenderer()
+		self.__last_json = level_json
+		self.__last_changes = ''
+	
+	def render(self,
+	           level: Level,
+	           level_format: str = 'prose') -> Tuple[str, str]:
+		# Returns the anchor and the changes since the anchor (empty if there are none)
+		level_json = self.renderer.fingerprint(level)
+		if self.__anchor_dump is None:
+			self.__set_anchor(level=level, level_json=level_json)
+		elif level_json != self.__last_json:
+			changes = '\n'.join(diff_dumps(old=self.__anchor_dump, new=json.loads(level_json)))
+			anchor_str = self.__anchor_renderer.render(level=self.__anchor_level, level_format=level_format)
+			if len(changes) > self.refresh_ratio * len(anchor_str):
+				self.n_refreshes += 1
+				self.__set_anchor(level=level, level_json=level_json)
+			else:
+				self.__last_json = level_json
+				self.__last_changes = changes
+		return self.__anchor_renderer.render(level=self.__anchor_level, level_format=level_format), self.__last_changes
+
+
+class FocusedLevelView:
+	"""
+	Renders only the part of a large level that is relevant to a request: the current room (or both ends of the
+	current corridor), the rooms within `hops` corridors of it, and the rooms, corridors and entities named in the
+	user message. Everything else is summarised in one line, so the prompt size stays roughly flat as levels grow.
+	Levels with fewer than `min_rooms` rooms are rendered whole.
+	"""
+	def __init__(self,
+	             renderer: LevelRenderer,
+	             hops: int = 1,
+	             min_rooms: int = 8,
+	             max_listed: int = 20):
+		self.renderer = renderer
+		self.hops = hops
+		self.min_rooms = min_rooms
+		self.max_listed = max_listed  # Names of omitted rooms listed in the summary line
+		self.__key: Optional[Tuple[str, str, str]] = None
+		self.__level_str: Optional[str] = None
+	
+	@staticmethod
+	def __entity_names(level: Level) -> Dict[str, Set[str]]:
+		# Names of the entities in each room and corridor
+		names = {}
+		for room_name in level.rooms:
+			enc = get_encounter(level=level, room_name=room_name, cell_index=-1)
+			names[room_name] = {entity.name for entities in enc.entities.values() for entity in entities}
+		for corridor_name, corridor in level.corridors.items():
+			names[corridor_name] = {entity.name for enc in corridor.encounters for entities in enc.entities.values() for entity in entities}
+		return names
+	
+	def select(self,
+	           level: Level,
+	           user_message: str) -> Tuple[Set[str], Set[str]]:
+		message = user_message.lower()
+		rooms, corridors = set(), set()
+		if level.current_room in level.rooms:
+			rooms.add(level.current_room)
+		elif level.current_room in level.corridors:
+			corridors.add(level.current_room)
+		for name, entity_names in self.__entity_names(level).items():
+			if name.lower() in message or any(entity_name.lower() in message for entity_name in entity_names):
+				(rooms if name in level.rooms else corridors).add(name)
+		for corridor_name in corridors:
+			corridor = level.corridors[corridor_name]
+			rooms.update({corridor.room_from, corridor.room_to})
+		# Breadth-first expansion over the corridors
+		frontier = set(rooms)
+		for _ in range(self.hops):
+			reached = set()
+			for corridor_name, corridor in level.corridors.items():
+				if corridor.room_from in frontier or corridor.room_to in frontier:
+					corridors.add(corridor_name)
+					reached.update({corridor.room_from, corridor.room_to})
+			frontier = reached - rooms
+			rooms.update(reached)
+		corridors.update({name for name, corridor in level.corridors.items() if corridor.room_from in rooms and corridor.room_to in rooms})
+		return rooms, corridors
+	
+	def render(self,
+	           level: Level,
+	           user_message: str,
+	           level_format: str = 'prose') -> str:
+		if len(level.rooms) < self.min_rooms:
+			return self.renderer.render(level=level, level_format=level_format)
+		key = (self.renderer.fingerprint(level), user_message, level_format)
+		if key == self.__key:
+			return self.__level_str
+		rooms, corridors = self.select(level=level, user_message=user_message)
+		view = level.model_copy(update={
+			'rooms': {name: room for name, room in level.rooms.items() if name in rooms},
+			'corridors': {name: corridor for name, corridor in level.corridors.items() if name in corridors}
+		})
+		omitted_rooms = [name for name in level.rooms if name not in rooms]
+		omitted_corridors = len(level.corridors) - len(view.corridors)
+		summary = []
+		if omitted_rooms:
+			listed = ', '.join(omitted_rooms[:self.max_listed]) + (', ...' if len(omitted_rooms) > self.max_listed else '')
+			summary.append(f'{len(omitted_rooms)} other rooms ({listed})')
+		if omitted_corridors > 0:
+			summary.append(f'{omitted_corridors} other corridors')
+		summary = f'Not shown: {" and ".join(summary)}.' if summary else ''
+		self.__key = key
+		self.__level_str = f'{LEVEL_FORMATS[level_format](view)}\n{summary}'.rstrip()
+		return self.__level_str
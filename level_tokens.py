@@ -0,0 +1,67 @@
+import glob
+from typing import List, Optional
+
+import fire
+import pandas as pd
+from tabulate import tabulate
+
+from configs import config
+from level_render import LEVEL_FORMATS
+from tokens import count_tokens, get_tokenizer, model_to_hf_repo
+from tool_schema import get_tool_schema_index
+from dungeon_despair.domain.level import Level
+
+roles = ['intent', 'params', 'summary', 'chat']
+
+
+def level_tokens(levels: str = './resources/levels/*/*.bin',
+                 models: Optional[List[str]] = None,
+                 level_formats: Optional[List[str]] = None) -> None:
+	"""
+	Compares the prompt tokens of each level format (see LEVEL_FORMATS) across the FreyrLLM roles.
+	Counts use the tokenizers under `config.llm.tokens_dir`, falling back to a characters-based estimate for models
+	whose tokenizer has not been downloaded.
+	"""
+	models = models if models is not None else list(model_to_hf_repo.keys())
+	level_formats = level_formats if level_formats is not None else list(LEVEL_FORMATS.keys())
+	schema = get_tool_schema_index()
+	operation = next(iter(schema.descriptions))
+	values = {
+		'intents_str': str({"conversation (msg)": "Ask for details, clarifications, or suggestions.", **schema.descriptions}),
+		'operation': operation,
+		'op_params_str': schema.op_params_str[operation]
+	}
+	prompts = {}
+	for role in roles:
+		with open(getattr(config.llm, role).prompt, 'r') as f:
+			prompts[role] = f.read()
+
+	fnames = sorted(glob.glob(levels))
+	assert len(fnames) > 0, f'No levels found in {levels}'
+	rows = []
+	for fname in fnames:
+		level = Level.load_from_file(fname)[0]
+		for level_format in level_formats:
+			level_str = LEVEL_FORMATS[level_format](level)
+			for model_name in models:
+				row = {
+					'model': model_name,
+					'tokenizer': 'yes' if get_tokenizer(model_name) is not None else 'estimate',
+					'format': level_format,
+					'level': count_tokens(level_str, model_name=model_name)
+				}
+				for role in roles:
+					row[role] = count_tokens(prompts[role].format(level_str=level_str, **values), model_name=model_name)
+				rows.append(row)
+
+	df = pd.DataFrame(rows).groupby(['model', 'tokenizer', 'format'], sort=False).mean().round(1).reset_index()
+	for column in ['level', *roles]:
+		prose = df[df['format'] == 'prose'].set_index('model')[column]
+		df[f'{column} (vs prose)'] = [f'{(1 - v / prose[m]):.1%}' if m in prose.index and prose[m] > 0 else '-'
+		                              for m, v in zip(df['model'], df[column])]
+	print(f'Mean tokens over {len(fnames)} levels:')
+	print(tabulate(df, headers='keys', tablefmt='psql', showindex=False))
+
+
+if __name__ == '__main__':
+	fire.Fire(level_tokens)
@@ -0,0 +1,167 @@
+import asyncio
+import queue
+import threading
+from timeit import default_timer
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generator, Iterator, Optional
+
+# A chat call yielded by the step generators of the LLMs, e.g. {'model_name': ..., 'messages': ...}
+# With 'stream': True the driver answers with a stream handle, and {'next_chunk': handle} with its next chunk
+ChatRequest = Dict[str, Any]
+Steps = Generator[ChatRequest, Any, Any]
+
+
+class ChatStream:
+	"""
+	Decodes a streamed chat in a background thread, so the steps can make other calls while it is decoding.
+	Closing the stream stops the decoding on the server.
+	"""
+	def __init__(self,
+	             chunks: Iterator[Dict[str, Any]],
+	             prompt_size: int = 0):
+		self.prompt_size = prompt_size  # Tokens of the prompt counted before the call, for the metrics
+		self.output: Dict[str, Any] = {}  # Last chunk, with the token counts if the stream was not closed early
+		self.n_chunks = 0
+		self.wait_time = 0.0  # Time the steps were blocked on this stream
+		self.elapsed: Optional[float] = None
+		self.finished_at: Optional[float] = None  # When the server was done with the stream (timer reading)
+		self.__start = default_timer()
+		self.__queue = queue.Queue()
+		self.__stop = threading.Event()
+		self.__thread = threading.Thread(target=self.__pump, args=(chunks,), daemon=True)
+		self.__thread.start()
+	
+	def __pump(self,
+	           chunks: Iterator[Dict[str, Any]]) -> None:
+		try:
+			for chunk in chunks:
+				self.__queue.put(chunk)
+				if self.__stop.is_set():
+					break
+		except Exception as e:
+			self.__queue.put(e)
+		finally:
+			if hasattr(chunks, 'close'):
+				chunks.close()
+			self.finished_at = default_timer()
+			self.__queue.put(None)
+	
+	def next_chunk(self) -> Optional[str]:
+		# Content of the next chunk, or None once the stream is over
+		if self.elapsed is not None:
+			return None
+		start = default_timer()
+		chunk = self.__queue.get()
+		self.wait_time += default_timer() - start
+		if isinstance(chunk, Exception):
+			self.close()
+			raise chunk
+		if chunk is None:
+			self.close()
+			return None
+		self.n_chunks += 1
+		self.output = chunk
+		return chunk['message']['content']
+	
+	def close(self) -> None:
+		if self.elapsed is None:
+			self.elapsed = default_timer() - self.__start
+			self.__stop.set()
+
+
+class AsyncChatStream:
+	"""
+	Same as ChatStream, but decodes in a task of the running event loop.
+	"""
+	def __init__(self,
+	             chunks: AsyncIterator[Dict[str, Any]],
+	             prompt_size: int = 0):
+		self.prompt_size = prompt_size  # Tokens of the prompt counted before the call, for the metrics
+		self.output: Dict[str, Any] = {}
+		self.n_chunks = 0
+		self.wait_time = 0.0
+		self.elapsed: Optional[float] = None
+		self.finished_at: Optional[float] = None
+		self.__start = default_timer()
+		self.__queue = asyncio.Queue()
+		self.__task = asyncio.create_task(self.__pump(chunks))
+	
+	async def __pump(self,
+	                 chunks: AsyncIterator[Dict[str, Any]]) -> None:
+		try:
+			async for chunk in chunks:
+				self.__queue.put_nowait(chunk)
+		except Exception as e:
+			self.__queue.put_nowait(e)
+		finally:
+			self.finished_at = default_timer()
+			self.__queue.put_nowait(None)
+	
+	async def next_chunk(self) -> Optional[str]:
+		if self.elapsed is not None:
+			return None
+		start = default_timer()
+		chunk = await self.__queue.get()
+		self.wait_time += default_timer() - start
+		if isinstance(chunk, Exception):
+			self.close()
+			raise chunk
+		if chunk is None:
+			self.close()
+			return None
+		self.n_chunks += 1
+		self.output = chunk
+		return chunk['message']['content']
+	
+	def close(self) -> None:
+		if self.elapsed is None:
+			self.elapsed = default_timer() - self.__start
+			self.__task.cancel()
+
+
+def drive(steps: Steps,
+          chat: Callable[..., Dict[str, Any]],
+          stream: Optional[Callable[..., ChatStream]] = None) -> Any:
+	"""
+	Runs the steps of an LLM to completion: every chat request they yield is sent to `chat` (or `stream`) and its
+	output is sent back in. Errors of the call are raised inside the steps, where they were raised before.
+	"""
+	try:
+		request = next(steps)
+		while True:
+			try:
+				if 'next_chunk' in request:
+					output = request['next_chunk'].next_chunk()
+				elif request.pop('stream', False):
+					output = stream(**request)
+				else:
+					output = chat(**request)
+			except Exception as e:
+				request = steps.throw(e)
+			else:
+				request = steps.send(output)
+	except StopIteration as e:
+		return e.value
+
+
+async def adrive(steps: Steps,
+                 achat: Callable[..., Awaitable[Dict[str, Any]]],
+                 astream: Optional[Callable[..., Awaitable[AsyncChatStream]]] = None) -> Any:
+	"""
+	Same as `drive`, but awaits the chat calls, so other conversations run while a model is generating.
+	"""
+	try:
+		request = next(steps)
+		while True:
+			try:
+				if 'next_chunk' in request:
+					output = await request['next_chunk'].next_chunk()
+				elif request.pop('stream', False):
+					output = await astream(**request)
+				else:
+					output = await achat(**request)
+			except Exception as e:
+				request = steps.throw(e)
+			else:
+				request = steps.send(output)
+	except StopIteration as e:
+		return e.value
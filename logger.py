@@ -1,16 +1,23 @@
 from datetime import datetime
 import os
+from typing import Optional
 
 
 class CustomLogger:
-	def __init__(self):
+	def __init__(self,
+	             dir_name: Optional[str] = None,
+	             expname: Optional[str] = None,
+	             root: str = './experiments'):
+		self.root = root
 		self.dir_name = None
-		self.expname = None
+		self.expname = expname
+		if dir_name is not None:
+			self.set_dirname(dir_name)
 	
 	def set_dirname(self,
 	                dir_name: str) -> None:
 		self.dir_name = dir_name
-		os.makedirs(f'./experiments/{self.dir_name}', exist_ok=True)
+		os.makedirs(f'{self.root}/{self.dir_name}', exist_ok=True)
 	
 	def start_exp(self,
 	              expname: str) -> None:
@@ -27,7 +34,7 @@ class CustomLogger:
 	              source: str,
 	              msg: str) -> None:
 		timestamp = f'{datetime.now():%Y-%m-%d %H:%M:%S%z}'
-		with open(f'./experiments/{self.dir_name}/{self.expname}.log', 'a') as f:
+		with open(f'{self.root}/{self.dir_name}/{self.expname}.log', 'a') as f:
 			f.write(f'[{timestamp}] {source} - {msg}\n')
 
 
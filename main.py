@@ -1,18 +1,28 @@
+import os
 from datetime import datetime
+from functools import lru_cache, partial
 from timeit import default_timer
-from typing import Union
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 
 import fire
-import pandas as pd
+import ollama
 from ollama import ResponseError
 from tqdm.auto import tqdm, trange
 
+from cassette import Cassette
 from configs import config
+from context import RunContext
 from freyr_llm import LLMsCache, FreyrLLM
-from logger import custom_logger
+from freyr_async_llm import AsyncFreyrLLM, get_async_client
+from logger import CustomLogger, custom_logger
 from tests import TestCase
+from tokens import model_to_hf_repo
 from tool_llm import ToolCallingLLM
-from freyr_outlines_llm import FreyrOutlinesLLM, OutlinesLLMsCache
+from tool_async_llm import AsyncToolCallingLLM
+from manifest import CompletionManifest
+from results import ResultsWriter
+from scheduler import SweepJob, SweepScheduler, build_jobs, count_model_loads, group_jobs, plan_group_order
+from dungeon_despair.domain.level import Level
 from validators import validate_level_design, validate_level_domain, validate_intents
 
 llms = [
@@ -34,28 +44,102 @@ n_runs = 10
 
 base_rng_seed = config.rng_seed
 
-model_to_hf_repo = {
-	'llama3.1': 'meta-llama/Llama-3.1-8B',
-	'qwen2.5': 'Qwen/Qwen2.5-7B',
-	'qwen2.5:0.5b': 'Qwen/Qwen2.5-0.5B',
-	'gemma2': 'google/gemma-2-9b',
-	'gemma2:27b': 'google/gemma-2-27b',
-	'command-r': 'CohereForAI/c4ai-command-r-v01',
-}
+
+def evaluate_step(llm: Union[FreyrLLM, ToolCallingLLM],
+                  tcase: TestCase,
+                  old_level: Level,
+                  level: Level,
+                  context: RunContext) -> Tuple[bool, bool, bool]:
+	if hasattr(llm, 'intents'):
+		try:
+			expected_intents = validate_intents(use_case=tcase.use_case,
+			                                    step=tcase.step - 1,
+			                                    intents=llm.intents)
+			context.logger.write_msg(source='main',
+			                         msg=f'{expected_intents=}')
+			if getattr(llm, 'intents_from_cache', False):
+				llm.intent_cache.add_outcome(correct=expected_intents)
+		except Exception as e:
+			context.logger.write_msg(source='main.validate_intents',
+			                         msg=f'Exception: {e} ({type(e)})')
+			expected_intents = False
+	else:
+		expected_intents = False
+	try:
+		valid_domain = validate_level_domain(use_case=tcase.use_case,
+		                                     step=tcase.step - 1,
+		                                     old_level=old_level,
+		                                     new_level=level)
+		context.logger.write_msg(source='main',
+		                         msg=f'{valid_domain=}')
+	except Exception as e:
+		context.logger.write_msg(source='main.validate_level_domain',
+		                         msg=f'Exception: {e} ({type(e)})')
+		valid_domain = False
+	if valid_domain:
+		try:
+			valid_design = validate_level_design(use_case=tcase.use_case,
+			                                     step=tcase.step - 1,
+			                                     old_level=old_level,
+			                                     new_level=level)
+			context.logger.write_msg(source='main',
+			                         msg=f'{valid_design=}')
+		except Exception as e:
+			context.logger.write_msg(source='main.validate_level_design',
+			                         msg=f'Exception: {e} ({type(e)})')
+			valid_design = False
+	else:
+		valid_design = False
+		context.logger.write_msg(source='main',
+		                         msg=f'{valid_design=}')
+	return expected_intents, valid_domain, valid_design
+
+
+def step_results(tcase: TestCase,
+                 q: str,
+                 success: bool,
+                 level: Level,
+                 llm_response: str,
+                 expected_intents: bool,
+                 valid_domain: bool,
+                 valid_design: bool,
+                 elapsed_time: float,
+                 context: RunContext,
+                 **kwargs) -> Dict[str, Any]:
+	return {
+		'intent_llm': kwargs.get('intent_llm', 'UNK'),
+		'params_llm': kwargs.get('params_llm', 'N/A'),
+		'summary_llm': other_llm,
+		'chat_llm': other_llm,
+		'run_n': kwargs.get('run_n', -1),
+		'logfile': kwargs.get('timestamp', 'N/A'),
+		'seed': context.seed,
+		'test_case': tcase.use_case,
+		'step': tcase.step,
+		'query': q,
+		'success': success,
+		'level': level.model_dump_json(),
+		'response': llm_response,
+		'expected_intents': expected_intents,
+		'valid_domain': valid_domain,
+		'valid_design': valid_design,
+		'elapsed_time': elapsed_time
+	}
 
 
 def run_test_case(llm: Union[FreyrLLM, ToolCallingLLM],
                   tcase: TestCase,
                   use_bootstrap: bool,
-                  results_df: pd.DataFrame,
-                  **kwargs):
+                  results_writer: ResultsWriter,
+                  context: RunContext,
+                  **kwargs) -> None:
 	level = tcase.get_level()
 	conversation_history = []
 	with trange(tcase.tot_steps, desc='Test Steps', dynamic_ncols=True, leave=False) as pbar:
 		while tcase.step < tcase.tot_steps:
 			q = tcase.get_query().strip()
-			custom_logger.write_msg(source='main',
-			                        msg=f'step={tcase.step}; query={q}')
+			context.logger.write_msg(source='main',
+			                         msg=f'step={tcase.step}; query={q}')
 			try:
 				if use_bootstrap:
 					level = tcase.get_level(tcase.step)
@@ -69,50 +153,15 @@ def run_test_case(llm: Union[FreyrLLM, ToolCallingLLM],
 			except (ValueError, KeyError, TypeError) as e:
 				end = default_timer()
 				success = False
-				custom_logger.write_msg(source='main',
-				                        msg=f'Exception: {e} ({type(e)})')
+				context.logger.write_msg(source='main',
+				                         msg=f'Exception: {e} ({type(e)})')
 			
 			if success:
-				if hasattr(llm, 'intents'):
-					try:
-						expected_intents = validate_intents(use_case=tcase.use_case,
-						                                    step=tcase.step - 1,
-						                                    intents=llm.intents)
-						custom_logger.write_msg(source='main',
-						                        msg=f'{expected_intents=}')
-					except Exception as e:
-						custom_logger.write_msg(source='main.validate_intents',
-						                        msg=f'Exception: {e} ({type(e)})')
-						expected_intents = False
-				else:
-					expected_intents = False
-				try:
-					valid_domain = validate_level_domain(use_case=tcase.use_case,
-					                                     step=tcase.step - 1,
-					                                     old_level=old_level,
-					                                     new_level=level)
-					custom_logger.write_msg(source='main',
-					                        msg=f'{valid_domain=}')
-				except Exception as e:
-					custom_logger.write_msg(source='main.validate_level_domain',
-					                        msg=f'Exception: {e} ({type(e)})')
-					valid_domain = False
-				if valid_domain:
-					try:
-						valid_design = validate_level_design(use_case=tcase.use_case,
-						                                     step=tcase.step - 1,
-						                                     old_level=old_level,
-						                                     new_level=level)
-						custom_logger.write_msg(source='main',
-						                        msg=f'{valid_design=}')
-					except Exception as e:
-						custom_logger.write_msg(source='main.validate_level_design',
-						                        msg=f'Exception: {e} ({type(e)})')
-						valid_design = False
-				else:
-					valid_design = False
-					custom_logger.write_msg(source='main',
-					                        msg=f'{valid_design=}')
+				expected_intents, valid_domain, valid_design = evaluate_step(llm=llm,
+				                                                             tcase=tcase,
+				                                                             old_level=old_level,
+				                                                             level=level,
+				                                                             context=context)
 				conversation_history.append(q)
 				conversation_history.append(llm_response)
 				pbar.update(1)
@@ -122,121 +171,330 @@ def run_test_case(llm: Union[FreyrLLM, ToolCallingLLM],
 				valid_design = False
 				llm_response = ''
 			
-			step_results = {
-				'intent_llm': kwargs.get('intent_llm', 'UNK'),
-				'params_llm': kwargs.get('params_llm', 'N/A'),
-				'summary_llm': other_llm,
-				'chat_llm': other_llm,
-				'run_n': kwargs.get('run_n', -1),
-				'logfile': kwargs.get('timestamp', 'N/A'),
-				'seed': config.rng_seed,
-				'test_case': tcase.use_case,
-				'step': tcase.step,
-				'query': q,
-				'success': success,
-				'level': level.model_dump_json(),
-				'response': llm_response,
-				'expected_intents': expected_intents,
-				'valid_domain': valid_domain,
-				'valid_design': valid_design,
-				'elapsed_time': end - start
-			}
-			results_df = pd.concat([pd.DataFrame(step_results, index=[0]), results_df], ignore_index=True)
-			results_df.to_csv(f'./experiments/{custom_logger.dir_name}/summary_results.csv', index=False)
+			results_writer.write_row(step_results(tcase=tcase,
+			                                      q=q,
+			                                      success=success,
+			                                      level=level,
+			                                      llm_response=llm_response,
+			                                      expected_intents=expected_intents,
+			                                      valid_domain=valid_domain,
+			                                      valid_design=valid_design,
+			                                      elapsed_time=end - start,
+			                                      context=context,
+			                                      **kwargs))
 			
 			if not valid_domain and not use_bootstrap:
 				break
-	return results_df
+
+
+async def run_test_case_async(llm: Union[AsyncFreyrLLM, AsyncToolCallingLLM],
+                              tcase: TestCase,
+                              use_bootstrap: bool,
+                              results_writer: ResultsWriter,
+                              context: RunContext,
+                              **kwargs) -> None:
+	# Same as run_test_case, but the model calls of a step yield to the other test cases of the event loop
+	level = tcase.get_level()
+	conversation_history = []
+	while tcase.step < tcase.tot_steps:
+		q = tcase.get_query().strip()
+		context.logger.write_msg(source='main',
+		                         msg=f'step={tcase.step}; query={q}')
+		try:
+			if use_bootstrap:
+				level = tcase.get_level(tcase.step)
+			old_level = level.model_copy(deep=True)
+			start = default_timer()
+			llm_response = await llm(user_message=q,
+			                         conversation_history=conversation_history,
+			                         level=level)
+			end = default_timer()
+			success = True
+		except (ValueError, KeyError, TypeError) as e:
+			end = default_timer()
+			success = False
+			context.logger.write_msg(source='main',
+			                         msg=f'Exception: {e} ({type(e)})')
+		
+		if success:
+			expected_intents, valid_domain, valid_design = evaluate_step(llm=llm,
+			                                                             tcase=tcase,
+			                                                             old_level=old_level,
+			                                                             level=level,
+			                                                             context=context)
+			conversation_history.append(q)
+			conversation_history.append(llm_response)
+		else:
+			expected_intents = False
+			valid_domain = False
+			valid_design = False
+			llm_response = ''
+		
+		results_writer.write_row(step_results(tcase=tcase,
+		                                      q=q,
+		                                      success=success,
+		                                      level=level,
+		                                      llm_response=llm_response,
+		                                      expected_intents=expected_intents,
+		                                      valid_domain=valid_domain,
+		                                      valid_design=valid_design,
+		                                      elapsed_time=end - start,
+		                                      context=context,
+		                                      **kwargs))
+		
+		if not valid_domain and not use_bootstrap:
+			break
+
+
+def start_sweep_job(job: SweepJob,
+                    msg: str,
+                    dirname: str,
+                    outlines_mode: bool = False,
+                    llmcache: Optional[LLMsCache] = None,
+                    client: Any = ollama,
+                    async_client: Optional[Any] = None) -> Tuple[Any, TestCase, RunContext, Dict[str, Any]]:
+	# Builds the LLM and the context of a job and logs its header; async LLMs are built if an async client is given
+	seed = base_rng_seed + (job.run_n * 5)
+	freyr_mode = job.params_llm is not None
+	timestamp = f'{datetime.now():%Y%m%d%H%M%S%f}'
+	if outlines_mode:
+		# Outlines LLMs still read the global seed and logger, so they only run on a single worker
+		config.rng_seed = seed
+		custom_logger.set_dirname(dirname)
+		context = RunContext(seed=seed, logger=custom_logger)
+		from freyr_outlines_llm import FreyrOutlinesLLM  # Only needed (and installed) for outlines runs
+		llm = FreyrOutlinesLLM(cache=llmcache)
+	else:
+		context = RunContext(seed=seed, logger=CustomLogger(dir_name=dirname))
+		if freyr_mode and async_client is not None:
+			llm = AsyncFreyrLLM(cache=llmcache, context=context, async_client=async_client)
+		elif freyr_mode:
+			llm = FreyrLLM(cache=llmcache, context=context)
+		elif async_client is not None:
+			llm = AsyncToolCallingLLM(model_name=job.intent_llm, keep_loaded=True, context=context, client=client, async_client=async_client)
+		else:
+			llm = ToolCallingLLM(model_name=job.intent_llm, keep_loaded=True, context=context, client=client)
+	testcase = TestCase(fname=job.tcase)
+	context.logger.start_exp(timestamp)
+	context.logger.write_msg(source='main.config',
+	                         msg=f'config={str(config.__dict__)}')
+	context.logger.write_msg(source='main.context',
+	                         msg=f'context={context}')
+	context.logger.write_msg(source='main.run_msg',
+	                         msg=f'run={msg}')
+	context.logger.write_msg(source='main',
+	                         msg=f'Start of Test Case {testcase.use_case} (run={job.run_n})')
+	if freyr_mode:
+		context.logger.write_msg(source='main',
+		                         msg=f'intent_llm={job.intent_llm!r}; params_llm={job.params_llm!r}')
+		run_info = {'params_llm': job.params_llm}
+	else:
+		context.logger.write_msg(source='main',
+		                         msg=f'model_name={job.intent_llm!r}')
+		run_info = {}
+	run_info = {'run_n': job.run_n,
+	            'timestamp': timestamp,
+	            'intent_llm': job.intent_llm,
+	            **run_info}
+	return llm, testcase, context, run_info
+
+
+def run_sweep_job(job: SweepJob,
+                  msg: str,
+                  dirname: str,
+                  bootstrap_mode: bool,
+                  results_writer: ResultsWriter,
+                  outlines_mode: bool = False,
+                  llmcache: Optional[LLMsCache] = None,
+                  client: Any = ollama) -> None:
+	llm, testcase, context, run_info = start_sweep_job(job=job,
+	                                                   msg=msg,
+	                                                   dirname=dirname,
+	                                                   outlines_mode=outlines_mode,
+	                                                   llmcache=llmcache,
+	                                                   client=client)
+	run_test_case(llm=llm,
+	              tcase=testcase,
+	              use_bootstrap=bootstrap_mode,
+	              results_writer=results_writer,
+	              context=context,
+	              **run_info)
+	if getattr(llm, 'intent_cache', None) is not None:
+		llm.intent_cache.save()  # So later runs start from it, with llm.intent_cache.persist
+		context.logger.write_msg(source='main',
+		                         msg=str(llm.intent_cache))
+	
+	context.logger.end_exp()
+
+
+async def run_sweep_job_async(job: SweepJob,
+                              msg: str,
+                              dirname: str,
+                              bootstrap_mode: bool,
+                              results_writer: ResultsWriter,
+                              async_client_factory: Callable[[], Any],
+                              llmcache: Optional[LLMsCache] = None,
+                              client: Any = ollama) -> None:
+	# The async client is only created here, within the event loop of the group
+	llm, testcase, context, run_info = start_sweep_job(job=job,
+	                                                   msg=msg,
+	                                                   dirname=dirname,
+	                                                   llmcache=llmcache,
+	                                                   client=client,
+	                                                   async_client=async_client_factory())
+	await run_test_case_async(llm=llm,
+	                          tcase=testcase,
+	                          use_bootstrap=bootstrap_mode,
+	                          results_writer=results_writer,
+	                          context=context,
+	                          **run_info)
+	if getattr(llm, 'intent_cache', None) is not None:
+		llm.intent_cache.save()  # So later runs start from it, with llm.intent_cache.persist
+		context.logger.write_msg(source='main',
+		                         msg=str(llm.intent_cache))
+	
+	context.logger.end_exp()
+
+
+def load_group_models(llmcache: LLMsCache,
+                      intent_llm: str,
+                      params_llm: str,
+                      outlines_mode: bool) -> None:
+	models = {role: model_name if not outlines_mode else model_to_hf_repo[model_name]
+	          for role, model_name in [('intent', intent_llm), ('params', params_llm)]}
+	cascades = {role: getattr(config.llm.cascade, role) if config.llm.cascade.enabled and not outlines_mode else None
+	            for role in models}
+	# Models needed by either role are never stopped, so swapping the two roles' models loads nothing
+	needed = {model_id for role in models for model_id in (cascades[role] or []) + [models[role]]}
+	swapped = [role for role in models
+	           if not llmcache.role_has_model(role=role) or llmcache.get_model_by_role(role=role) != models[role]]
+	for role in swapped:
+		if llmcache.role_has_model(role=role):
+			llmcache.drop_model_by_role(role=role,
+			                            keep=needed)
+	for role in swapped:
+		llmcache.try_add_model(role=role,
+		                       model_name=models[role],
+		                       cascade=cascades[role])
 
 
 def run_experiment(msg: str,
                    dirname: str,
                    freyr_mode: bool,
                    bootstrap_mode: bool,
-                   outlines_mode: bool = False) -> None:
-	summary_results = pd.DataFrame()
+                   outlines_mode: bool = False,
+                   n_workers: int = 1,
+                   resume: bool = False,
+                   cassette: Optional[str] = None,
+                   cassette_mode: str = 'replay',
+                   cassette_latency: str = 'original',
+                   async_mode: bool = False) -> None:
+	# A cassette records every model call, or replays them without an Ollama server
+	client = Cassette(fname=cassette, mode=cassette_mode, latency=cassette_latency) if cassette is not None else ollama
+	os.makedirs(f'./experiments/{dirname}', exist_ok=True)
+	results_fname = f'./experiments/{dirname}/summary_results.csv'
+	manifest = CompletionManifest(fname=f'./experiments/{dirname}/manifest.jsonl')
+	results_writer = ResultsWriter(fname=results_fname)
+	if resume:
+		completed = {tuple(str(x) for x in job.results_key) for job in manifest.completed}
+		# Rows of partially finished test cases are dropped; those test cases are run again
+		results_writer.compact(keep=lambda row: (row['intent_llm'], row['params_llm'], row['run_n'], row['test_case']) in completed)
+	else:
+		manifest.reset()
+		results_writer.reset()
 	
+	if outlines_mode and n_workers > 1:
+		print('Outlines LLMs rely on the global seed and logger; using a single worker.')
+		n_workers = 1
+	if outlines_mode and async_mode:
+		print('Outlines LLMs do not have an async execution path; using the blocking one.')
+		async_mode = False
+	
+	jobs = build_jobs(intent_llms=llms,
+	                  params_llms=llms if freyr_mode else None,
+	                  n_runs=n_runs,
+	                  tcases=tcases)
+	if resume:
+		n_jobs = len(jobs)
+		jobs = [job for job in jobs if not manifest.is_done(job)]
+		print(f'Resuming {dirname}: {n_jobs - len(jobs)}/{n_jobs} jobs already completed.')
+	groups = group_jobs(jobs)
+	
+	# Order model combinations so as few models as possible are (re)loaded
+	resident = set()
 	if freyr_mode:
-		llmcache = LLMsCache() if not outlines_mode else OutlinesLLMsCache()
-		llmcache.try_add_model(role='summary', model_name=other_llm if not outlines_mode else model_to_hf_repo[other_llm])
+		resident = {other_llm} | ({config.llm.intent.draft_model} if config.llm.intent.speculative and not outlines_mode else set())
+	order = plan_group_order(groups=list(groups.keys()),
+	                         resident=resident)
+	print(f'Planned {count_model_loads(order=order, resident=resident)} model loads for {len(order)} model combinations '
+	      f'(unplanned order: {count_model_loads(order=list(groups.keys()), resident=resident)}).')
+	groups = {group: groups[group] for group in order}
+	
+	llmcache = None
+	if freyr_mode:
+		if outlines_mode:
+			from freyr_outlines_llm import OutlinesLLMsCache  # Only needed (and installed) for outlines runs
+		llmcache = LLMsCache(client=client) if not outlines_mode else OutlinesLLMsCache()
+		if config.llm.summary.mode != 'templates' or outlines_mode:  # Outlines LLMs always summarise with the model
+			llmcache.try_add_model(role='summary', model_name=other_llm if not outlines_mode else model_to_hf_repo[other_llm])
 		llmcache.try_add_model(role='chat', model_name=other_llm if not outlines_mode else model_to_hf_repo[other_llm])
+		if config.llm.intent.speculative and not outlines_mode:
+			llmcache.try_add_model(role='draft', model_name=config.llm.intent.draft_model)
+	
+	with results_writer, tqdm(total=len(jobs), desc='Jobs', dynamic_ncols=True, leave=False) as jobs_pbar:
+		def on_job_done(job: SweepJob,
+		                _) -> None:
+			results_writer.flush()
+			# Only record the job once its rows are durably on disk
+			manifest.mark_done(job)
+			jobs_pbar.update(1)
 		
-		with tqdm(llms, desc='Intent LLMs', dynamic_ncols=True, leave=False) as intent_pbar:
-			with tqdm(llms, 'Param LLMs', dynamic_ncols=True, leave=False) as params_pbar:
-				for intent_llm in intent_pbar:
-					intent_pbar.set_description(f'Intent LLM {intent_llm}')
-					if llmcache.role_has_model(role='intent'): llmcache.drop_model_by_role(role='intent')
-					llmcache.try_add_model(role='intent', model_name=intent_llm if not outlines_mode else model_to_hf_repo[intent_llm])
-					for params_llm in params_pbar:
-						if llmcache.role_has_model(role='params'): llmcache.drop_model_by_role(role='params')
-						params_pbar.set_description(f'Param LLM {params_llm}')
-						llmcache.try_add_model(role='params', model_name=params_llm if not outlines_mode else model_to_hf_repo[params_llm])
-						for run_n in trange(n_runs, desc='Runs', dynamic_ncols=True, leave=False):
-							for tcase in tqdm(tcases, desc='Test cases', dynamic_ncols=True, leave=False):
-								config.rng_seed = base_rng_seed + (run_n * 5)
-								llm = FreyrLLM(cache=llmcache) if not outlines_mode else FreyrOutlinesLLM(cache=llmcache)
-								timestamp = f'{datetime.now():%Y%m%d%H%M%S%z}'
-								testcase = TestCase(fname=tcase)
-								custom_logger.set_dirname(dirname)
-								custom_logger.start_exp(timestamp)
-								custom_logger.write_msg(source='main.config',
-								                        msg=f'config={str(config.__dict__)}')
-								custom_logger.write_msg(source='main.run_msg',
-								                        msg=f'run={msg}')
-								custom_logger.write_msg(source='main',
-								                        msg=f'Start of Test Case {testcase.use_case} (run={run_n})')
-								custom_logger.write_msg(source='main',
-								                        msg=f'{intent_llm=}; {params_llm=}')
-								
-								summary_results = run_test_case(llm=llm,
-								                                tcase=testcase,
-								                                use_bootstrap=bootstrap_mode,
-								                                results_df=summary_results,
-								                                **{'run_n': run_n,
-								                                   'timestamp': timestamp,
-								                                   'intent_llm': intent_llm,
-								                                   'params_llm': params_llm})
-								
-								custom_logger.end_exp()
-						
-						llmcache.drop_model_by_role(role='params')
-					llmcache.drop_model_by_role(role='intent')
+		with SweepScheduler(n_workers=n_workers, async_mode=async_mode) as scheduler:
+			for (intent_llm, params_llm), group in groups.items():
+				jobs_pbar.set_description(f'Intent LLM {intent_llm}' + (f'; Param LLM {params_llm}' if freyr_mode else ''))
+				if async_mode:
+					# Each group runs on its own event loop, so it gets its own async client, shared by its jobs
+					run_job = partial(run_sweep_job_async,
+					                  msg=msg,
+					                  dirname=dirname,
+					                  bootstrap_mode=bootstrap_mode,
+					                  results_writer=results_writer,
+					                  async_client_factory=lru_cache(maxsize=None)(partial(get_async_client, client=client)),
+					                  llmcache=llmcache,
+					                  client=client)
+					run_group = scheduler.run_group_async
+				else:
+					run_job = partial(run_sweep_job,
+					                  msg=msg,
+					                  dirname=dirname,
+					                  bootstrap_mode=bootstrap_mode,
+					                  results_writer=results_writer,
+					                  outlines_mode=outlines_mode,
+					                  llmcache=llmcache,
+					                  client=client)
+					run_group = scheduler.run_group
+				if freyr_mode:
+					load_group_models(llmcache=llmcache,
+					                  intent_llm=intent_llm,
+					                  params_llm=params_llm,
+					                  outlines_mode=outlines_mode)
+					run_group(jobs=group,
+					          run_job=run_job,
+					          on_job_done=on_job_done)
+				else:
+					try:
+						run_group(jobs=group,
+						          run_job=run_job,
+						          on_job_done=on_job_done)
+					except ResponseError as e:
+						print(f'Skipped {intent_llm} as it does not support tools. - {e}')
+					ToolCallingLLM.unload_model(model_name=intent_llm, client=client)
 	
-	else:
-		with tqdm(llms, desc='LLMs', dynamic_ncols=True, leave=False) as llm_pbar:
-			for model_name in llm_pbar:
-				llm_pbar.set_description(f'LLM {model_name}')
-				try:
-					for run_n in trange(n_runs, desc='Runs', dynamic_ncols=True, leave=False):
-						config.rng_seed = base_rng_seed + (run_n * 5)
-						for tcase in tqdm(tcases, desc='Test cases', dynamic_ncols=True, leave=False):
-							config.rng_seed = base_rng_seed + (run_n * 5)
-							llm = ToolCallingLLM(model_name=model_name)
-							timestamp = f'{datetime.now():%Y%m%d%H%M%S%z}'
-							testcase = TestCase(fname=tcase)
-							custom_logger.set_dirname(dirname)
-							custom_logger.start_exp(timestamp)
-							custom_logger.write_msg(source='main.config',
-							                        msg=f'config={str(config.__dict__)}')
-							custom_logger.write_msg(source='main.run_msg',
-							                        msg=f'run={msg}')
-							custom_logger.write_msg(source='main',
-							                        msg=f'Start of Test Case {testcase.use_case} (run={run_n})')
-							custom_logger.write_msg(source='main',
-							                        msg=f'{model_name=}')
-							
-							summary_results = run_test_case(llm=llm,
-							                                tcase=testcase,
-							                                use_bootstrap=bootstrap_mode,
-							                                results_df=summary_results,
-							                                **{'run_n': run_n,
-							                                   'timestamp': timestamp,
-							                                   'intent_llm': model_name})
-							
-							custom_logger.end_exp()
-				except ResponseError as e:
-					print(f'Skipped {model_name} as it does not support tools. - {e}')
-					pass
+	if freyr_mode:
+		for role in ['intent', 'params']:
+			if llmcache.role_has_model(role=role): llmcache.drop_model_by_role(role=role)
+	if cassette is not None:
+		client.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,60 @@
+import json
+import os
+from typing import Set
+
+from scheduler import SweepJob
+
+
+def fsync_dir(dir_name: str) -> None:
+	# Make renames and newly created files in dir_name durable
+	fd = os.open(dir_name, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+class CompletionManifest:
+	"""
+	Append-only record of the sweep jobs that finished and whose results are on disk.
+	Every entry is fsync'd before `mark_done` returns, and a line torn by a kill is dropped on load.
+	"""
+	def __init__(self,
+	             fname: str):
+		self.fname = fname
+		self.completed: Set[SweepJob] = set()
+		if os.path.exists(self.fname):
+			self.__load()
+
+	def __load(self) -> None:
+		with open(self.fname, 'rb') as f:
+			data = f.read()
+		# Anything after the last newline is a partial write from a killed run
+		valid_size = data.rfind(b'\n') + 1
+		if valid_size < len(data):
+			with open(self.fname, 'r+b') as f:
+				f.truncate(valid_size)
+				f.flush()
+				os.fsync(f.fileno())
+		for line in data[:valid_size].decode('utf-8').splitlines():
+			if line.strip() != '':
+				self.completed.add(SweepJob(**json.loads(line)))
+
+	def reset(self) -> None:
+		self.completed = set()
+		with open(self.fname, 'w') as f:
+			f.flush()
+			os.fsync(f.fileno())
+		fsync_dir(os.path.dirname(self.fname) or '.')
+
+	def is_done(self,
+	            job: SweepJob) -> bool:
+		return job in self.completed
+
+	def mark_done(self,
+	              job: SweepJob) -> None:
+		with open(self.fname, 'a') as f:
+			f.write(json.dumps(job._asdict()) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+		self.completed.add(job)
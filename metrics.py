@@ -0,0 +1,124 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from timeit import default_timer
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+
+class StageRecord:
+	def __init__(self,
+	             stage: str):
+		self.stage = stage
+		self.wall_time = 0.0
+		self.llm_time = 0.0
+		self.n_calls = 0
+		self.prompt_tokens = 0
+		self.completion_tokens = 0
+		self.prompt_size = 0  # Estimated tokens of the whole prompts, cached or not
+
+	@property
+	def overhead_time(self) -> float:
+		# Time spent in Python (prompt building, parsing, tool calls, ...) rather than waiting on a model
+		return self.wall_time - self.llm_time
+
+	def as_dict(self) -> Dict[str, Any]:
+		return {
+			'stage': self.stage,
+			'wall_time': self.wall_time,
+			'llm_time': self.llm_time,
+			'overhead_time': self.overhead_time,
+			'n_calls': self.n_calls,
+			'prompt_tokens': self.prompt_tokens,
+			'completion_tokens': self.completion_tokens,
+			'prompt_size': self.prompt_size
+		}
+
+
+class StageMetrics:
+	"""
+	Collects wall time, model time and token counts per pipeline stage.
+	Stages nest (e.g. extract_intents inside __call__): a model call counts towards every open stage of its thread
+	or asyncio task.
+	"""
+	def __init__(self):
+		self.records: List[StageRecord] = []
+		self.escalations: Dict[Tuple[str, str], List[int]] = {}  # (role, model) -> [answered, escalated]
+		self.__lock = threading.Lock()
+		# Tasks copy the context of their parent, so the stack is replaced rather than mutated in place
+		self.__open_stages: ContextVar[Tuple[StageRecord, ...]] = ContextVar(f'open_stages_{id(self)}', default=())
+
+	@contextmanager
+	def stage(self,
+	          name: str) -> Iterator[StageRecord]:
+		record = StageRecord(stage=name)
+		self.__open_stages.set((*self.__open_stages.get(), record))
+		start = default_timer()
+		try:
+			yield record
+		finally:
+			record.wall_time = default_timer() - start
+			self.__open_stages.set(tuple(r for r in self.__open_stages.get() if r is not record))
+			with self.__lock:
+				self.records.append(record)
+
+	def add_record(self,
+	               record: StageRecord) -> None:
+		# For stages that overlap others (e.g. a streamed call), so they cannot be timed as an open stage
+		with self.__lock:
+			self.records.append(record)
+
+	def add_llm_call(self,
+	                 llm_time: float,
+	                 prompt_tokens: int,
+	                 completion_tokens: int,
+	                 prompt_size: int = 0) -> None:
+		for record in self.__open_stages.get():
+			record.llm_time += llm_time
+			record.n_calls += 1
+			record.prompt_tokens += prompt_tokens
+			record.completion_tokens += completion_tokens
+			record.prompt_size += prompt_size
+
+	def add_escalation(self,
+	                   role: str,
+	                   model_name: str,
+	                   escalated: bool) -> None:
+		# Outcome of a call to one of the models of a cascade (see LLMsCache.get_cascade_by_role)
+		with self.__lock:
+			counts = self.escalations.setdefault((role, model_name), [0, 0])
+			counts[int(escalated)] += 1
+
+	def escalation_summary(self) -> Dict[str, Dict[str, float]]:
+		with self.__lock:
+			escalations = dict(self.escalations)
+		return {f'{role}/{model_name}': {'n': answered + escalated, 'escalation_rate': escalated / (answered + escalated)}
+		        for (role, model_name), (answered, escalated) in sorted(escalations.items())}
+
+	def summary(self) -> Dict[str, Dict[str, float]]:
+		with self.__lock:
+			records = list(self.records)
+		summary = {}
+		for stage in sorted({record.stage for record in records}):
+			stage_records = [record for record in records if record.stage == stage]
+			wall_times = np.array([record.wall_time for record in stage_records])
+			overhead_times = np.array([record.overhead_time for record in stage_records])
+			prompt_size = sum(record.prompt_size for record in stage_records)
+			# Ollama only counts the prompt tokens it had to prefill, so the rest of the prompt came from its cache
+			cache_hit_rate = 1.0 - sum(record.prompt_tokens for record in stage_records) / prompt_size if prompt_size > 0 else float('nan')
+			summary[stage] = {
+				'n': len(stage_records),
+				'wall_p50': float(np.percentile(wall_times, 50)),
+				'wall_p95': float(np.percentile(wall_times, 95)),
+				'wall_p99': float(np.percentile(wall_times, 99)),
+				'overhead_p50': float(np.percentile(overhead_times, 50)),
+				'overhead_p95': float(np.percentile(overhead_times, 95)),
+				'overhead_p99': float(np.percentile(overhead_times, 99)),
+				'mean_calls': float(np.mean([record.n_calls for record in stage_records])),
+				'mean_prompt_tokens': float(np.mean([record.prompt_tokens for record in stage_records])),
+				'mean_completion_tokens': float(np.mean([record.completion_tokens for record in stage_records])),
+				'prefix_cache_hit_rate': float(np.clip(cache_hit_rate, 0.0, 1.0))
+			}
+		return summary
+
@@ -0,0 +1,391 @@
+import ast
+import hashlib
+import json
+import random
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import fire
+import yaml
+
+# Keywords used to guess which operations a designer message asks for
+OPERATION_KEYWORDS = [
+	('remove_entity', ['remove', 'delete']),
+	('update_enemy_properties', ['change', 'set the', 'make the', 'update']),
+	('create_room', ['room', 'chamber', 'cavern']),
+	('add_enemy', ['enemy', 'enemies', 'monster', 'zombie', 'archer', 'spider', 'angel', 'mermaid', 'bat', 'cat', 'shadow']),
+	('add_trap', ['trap']),
+	('add_treasure', ['treasure', 'chest', 'loot']),
+]
+COUNT_WORDS = {'two': 2, 'couple': 2, 'pair': 2, 'three': 3, 'multiple': 3, 'several': 3, 'four': 4}
+PARAM_VALUES = {
+	'hp': '10',
+	'dodge': '0.5',
+	'prot': '0.5',
+	'spd': '0.5',
+	'cell_index': '-1',
+	'direction': 'east',
+	'entity_type': 'enemy',
+}
+
+
+def count_tokens(text: str) -> int:
+	return len(text) // 4 + 1  # Rough estimate, good enough for timings
+
+
+class ModelProfile:
+	def __init__(self,
+	             prefill_tps: float = 2000.0,
+	             decode_tps: float = 50.0,
+	             load_time: float = 2.0,
+	             error_rate: float = 0.0,
+	             supports_tools: bool = True,
+	             parallel: int = 1):
+		self.prefill_tps = prefill_tps
+		self.decode_tps = decode_tps
+		self.load_time = load_time
+		self.error_rate = error_rate
+		self.supports_tools = supports_tools
+		self.parallel = parallel
+
+
+class MockOllama:
+	"""
+	Deterministic stand-in for an Ollama server: it answers FREYR's intent, params, summary, chat and
+	tool-calling prompts with parseable canned responses, and takes as long as the model profile says.
+	"""
+	def __init__(self,
+	             profiles: Dict[str, ModelProfile],
+	             default_profile: ModelProfile,
+	             max_loaded: int = 3,
+	             seed: int = 0,
+	             time_scale: float = 1.0):
+		self.profiles = profiles
+		self.default_profile = default_profile
+		self.max_loaded = max_loaded
+		self.seed = seed
+		self.time_scale = time_scale
+		self.__loaded: OrderedDict = OrderedDict()
+		self.__lock = threading.Lock()
+		self.__slots: Dict[str, threading.Semaphore] = {}
+		self.__n_requests = defaultdict(int)
+
+	def get_profile(self,
+	                model: str) -> ModelProfile:
+		return self.profiles.get(model, self.profiles.get(model.replace(':latest', ''), self.default_profile))
+
+	def __wait(self,
+	           seconds: float) -> None:
+		if seconds > 0: sleep(seconds * self.time_scale)
+
+	def __rng(self,
+	          model: str,
+	          body: Dict[str, Any]) -> random.Random:
+		# Same request, same n-th repetition -> same outcome, whatever the concurrency
+		key = json.dumps(body, sort_keys=True, default=str)
+		with self.__lock:
+			self.__n_requests[key] += 1
+			n = self.__n_requests[key]
+		digest = hashlib.sha256(f'{self.seed}-{n}-{model}-{key}'.encode('utf-8')).hexdigest()
+		return random.Random(int(digest[:16], 16))
+
+	def load(self,
+	         model: str) -> float:
+		with self.__lock:
+			if model in self.__loaded:
+				self.__loaded.move_to_end(model)
+				return 0.0
+			while len(self.__loaded) >= self.max_loaded:
+				self.__loaded.popitem(last=False)
+			self.__loaded[model] = datetime.now(timezone.utc).isoformat()
+			self.__slots.setdefault(model, threading.Semaphore(self.get_profile(model).parallel))
+		load_time = self.get_profile(model).load_time
+		self.__wait(load_time)
+		return load_time
+
+	def unload(self,
+	           model: str) -> None:
+		with self.__lock:
+			self.__loaded.pop(model, None)
+
+	def tags(self) -> Dict[str, Any]:
+		return {'models': [{'name': name, 'model': name, 'size': 0, 'digest': '', 'details': {}} for name in self.profiles.keys()]}
+
+	def ps(self) -> Dict[str, Any]:
+		with self.__lock:
+			return {'models': [{'name': name, 'model': name, 'size': 0, 'expires_at': since} for name, since in self.__loaded.items()]}
+
+	def pull(self,
+	         body: Dict[str, Any]) -> Dict[str, Any]:
+		return {'status': 'success'}
+
+	def generate(self,
+	             body: Dict[str, Any],
+	             stream: bool = False) -> Tuple[int, Any]:
+		model = body['model']
+		if body.get('keep_alive', None) == 0:
+			self.unload(model)
+			return 200, {'model': model, 'response': '', 'done': True, 'done_reason': 'unload'}
+		load_time = self.load(model)
+		prompt = body.get('prompt', '')
+		if prompt == '':
+			return 200, {'model': model, 'response': '', 'done': True, 'done_reason': 'load', 'load_duration': int(load_time * 1e9)}
+		return self.__complete(model=model, body=body, prompt_text=prompt, load_time=load_time,
+		                       message=None, response=f'Mock response from {model}.', stream=stream)
+
+	def chat(self,
+	         body: Dict[str, Any],
+	         stream: bool = False) -> Tuple[int, Any]:
+		model = body['model']
+		profile = self.get_profile(model)
+		tools = body.get('tools', None)
+		if tools and not profile.supports_tools:
+			return 400, {'error': f'{model} does not support tools'}
+		load_time = self.load(model)
+		messages = body.get('messages', [])
+		prompt_text = ''.join(str(m.get('content', '')) for m in messages)
+		message = respond(messages=messages, tools=tools)
+		return self.__complete(model=model, body=body, prompt_text=prompt_text, load_time=load_time,
+		                       message=message, response=None, stream=stream)
+
+	def __complete(self,
+	               model: str,
+	               body: Dict[str, Any],
+	               prompt_text: str,
+	               load_time: float,
+	               message: Optional[Dict[str, Any]],
+	               response: Optional[str],
+	               stream: bool = False) -> Tuple[int, Any]:
+		# With `stream`, returns the chunks to send, each one only once the profile says it has been decoded
+		profile = self.get_profile(model)
+		if self.__rng(model, body).random() < profile.error_rate:
+			return 500, {'error': f'injected error for {model}'}
+		output_text = message['content'] + json.dumps(message.get('tool_calls', [])) if message is not None else response
+		prompt_tokens, completion_tokens = count_tokens(prompt_text), count_tokens(output_text)
+		prefill_time = prompt_tokens / profile.prefill_tps
+		decode_time = completion_tokens / profile.decode_tps
+		if not stream:
+			with self.__slots[model]:  # Requests beyond `parallel` queue up, like OLLAMA_NUM_PARALLEL
+				self.__wait(prefill_time + decode_time)
+		payload = {
+			'model': model,
+			'created_at': datetime.now(timezone.utc).isoformat(),
+			'done': True,
+			'done_reason': 'stop',
+			'total_duration': int((load_time + prefill_time + decode_time) * 1e9),
+			'load_duration': int(load_time * 1e9),
+			'prompt_eval_count': prompt_tokens,
+			'prompt_eval_duration': int(prefill_time * 1e9),
+			'eval_count': completion_tokens,
+			'eval_duration': int(decode_time * 1e9),
+		}
+		if message is not None:
+			payload['message'] = message
+		else:
+			payload['response'] = response
+		if stream:
+			return 200, self.__chunks(model=model, payload=payload, prefill_time=prefill_time, decode_tps=profile.decode_tps)
+		return 200, payload
+
+	def __chunks(self,
+	             model: str,
+	             payload: Dict[str, Any],
+	             prefill_time: float,
+	             decode_tps: float) -> Iterator[Dict[str, Any]]:
+		key = 'message' if 'message' in payload else 'response'
+		text = payload[key]['content'] if key == 'message' else payload[key]
+		with self.__slots[model]:  # The slot is held until the last chunk has been decoded
+			self.__wait(prefill_time)  # Time to first token
+			# About one token per chunk (see count_tokens), each one decoded in 1 / decode_tps
+			for i, chunk in enumerate(re.findall(r'.{1,4}', text, re.DOTALL)):
+				if i > 0:
+					self.__wait(1 / decode_tps)
+				part = {**payload[key], 'content': chunk} if key == 'message' else chunk
+				yield {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), key: part, 'done': False}
+		yield {**payload, 'created_at': datetime.now(timezone.utc).isoformat(), key: {**payload[key], 'content': ''} if key == 'message' else ''}
+
+
+def guess_operations(user_message: str,
+                     available: List[str]) -> List[str]:
+	text = user_message.lower()
+	n = 1
+	for word, count in COUNT_WORDS.items():
+		if re.search(rf'\b{word}\b', text): n = count
+	digits = re.findall(r'\b([2-9])\b', text)
+	if len(digits) > 0: n = int(digits[0])
+	for operation, keywords in OPERATION_KEYWORDS:
+		if operation in available and any(keyword in text for keyword in keywords):
+			return [operation] * (n if operation.startswith('add_') else 1)
+	return ['conversation']
+
+
+def guess_param_value(param_name: str,
+                      user_message: str) -> str:
+	if param_name in PARAM_VALUES:
+		return PARAM_VALUES[param_name]
+	if 'description' in param_name:
+		return user_message
+	words = re.findall(r'[A-Za-z]+', user_message)
+	return f'Mock {" ".join(words[-2:]).title()}' if len(words) > 0 else 'Mock'
+
+
+def last_user_message(messages: List[Dict[str, Any]]) -> str:
+	for message in reversed(messages):
+		if message.get('role') == 'user':
+			content = str(message.get('content', ''))
+			# With the 'prefix' layout, the volatile sections of the prompt come before the message itself
+			if 'Designer: ' in content:
+				return content.rsplit('Designer: ', 1)[1]
+			return content.rsplit('\n\n', 1)[-1] if content.startswith('<') else content
+	return ''
+
+
+def prompt_section(text: str,
+                   heading: str) -> Optional[str]:
+	# The first paragraph after `heading`, e.g. the operations or the parameters listed in a prompt
+	match = re.search(rf'{re.escape(heading)}\n(.*?)(?:\n\n|$)', text, re.DOTALL)
+	return match.group(1).strip() if match is not None else None
+
+
+def respond(messages: List[Dict[str, Any]],
+            tools: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+	system = str(messages[0].get('content', '')) if len(messages) > 0 and messages[0].get('role') == 'system' else ''
+	last_user = next((str(m.get('content', '')) for m in reversed(messages) if m.get('role') == 'user'), '')
+	prompt = f'{system}\n\n{last_user}'  # Sections may be in either, depending on the prompt layout
+	user_message = last_user_message(messages)
+	if tools:
+		if messages[-1].get('role') == 'tool':
+			return {'role': 'assistant', 'content': 'Done, the level has been updated.'}
+		names = [tool['function']['name'] for tool in tools]
+		operation = guess_operations(user_message, names)[0]
+		if operation == 'conversation':
+			return {'role': 'assistant', 'content': 'Sure, what would you like to add next?'}
+		tool = tools[names.index(operation)]
+		arguments = {}
+		for param_name, param in tool['function']['parameters']['properties'].items():
+			value = guess_param_value(param_name, user_message)
+			if param.get('type') == 'integer': value = int(float(value)) if re.fullmatch(r'-?[\d.]+', value) else 0
+			elif param.get('type') == 'number': value = float(value) if re.fullmatch(r'-?[\d.]+', value) else 0.0
+			arguments[param_name] = value
+		return {'role': 'assistant', 'content': '', 'tool_calls': [{'function': {'name': operation, 'arguments': arguments}}]}
+	if '<Operations>' in prompt:
+		try:
+			available = list(ast.literal_eval(prompt_section(prompt, '(name and description):')).keys())
+		except (ValueError, SyntaxError):
+			available = [operation for operation, _ in OPERATION_KEYWORDS]
+		return {'role': 'assistant', 'content': ', '.join(guess_operations(user_message, available))}
+	if '<Parameters>' in prompt:
+		if messages[-1].get('role') == 'user' and 'There was an error' in str(messages[-1].get('content', '')):
+			return {'role': 'assistant', 'content': 'OpError'}
+		try:
+			params = ast.literal_eval(prompt_section(prompt, "These are the operation's parameters:"))
+		except (ValueError, SyntaxError):
+			params = {}
+		return {'role': 'assistant', 'content': '\n'.join(f'- {k}: {guess_param_value(k, user_message)}' for k in params.keys())}
+	return {'role': 'assistant', 'content': 'I have updated the level as requested.'}
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+	server_version = 'MockOllama/0.1'
+	mock: MockOllama = None
+
+	def log_message(self, format: str, *args) -> None:
+		pass  # Keep the console quiet during load tests
+
+	def __send(self,
+	           status: int,
+	           payload: Dict[str, Any]) -> None:
+		data = json.dumps(payload).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def __stream(self,
+	             status: int,
+	             chunks: Any) -> None:
+		if status != 200:
+			return self.__send(status, chunks)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/x-ndjson')
+		self.end_headers()
+		try:
+			for chunk in chunks:  # Paced by the mock, so each chunk is written as soon as it is decoded
+				self.wfile.write((json.dumps(chunk) + '\n').encode('utf-8'))
+				self.wfile.flush()
+		finally:
+			if hasattr(chunks, 'close'):
+				chunks.close()  # Frees the slot if the client hung up
+
+	def do_HEAD(self) -> None:
+		self.send_response(200)
+		self.end_headers()
+
+	def do_GET(self) -> None:
+		if self.path == '/api/tags':
+			return self.__send(200, self.mock.tags())
+		if self.path == '/api/ps':
+			return self.__send(200, self.mock.ps())
+		if self.path == '/':
+			data = b'Ollama is running'
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(data)))
+			self.end_headers()
+			return self.wfile.write(data)
+		return self.__send(404, {'error': f'unknown endpoint {self.path}'})
+
+	def do_POST(self) -> None:
+		body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+		stream = body.get('stream', True)  # Ollama streams unless told otherwise
+		if self.path == '/api/chat':
+			status, payload = self.mock.chat(body, stream=stream)
+		elif self.path == '/api/generate':
+			status, payload = self.mock.generate(body, stream=stream)
+		elif self.path == '/api/pull':
+			return self.__send(200, self.mock.pull(body))
+		else:
+			return self.__send(404, {'error': f'unknown endpoint {self.path}'})
+		if stream:
+			self.__stream(status, payload)
+		else:
+			self.__send(status, payload)
+
+	def do_DELETE(self) -> None:
+		self.__send(200, {})
+
+
+def load_profiles(fname: Optional[str]) -> Tuple[Dict[str, ModelProfile], ModelProfile]:
+	if fname is None:
+		return {}, ModelProfile()
+	with open(fname, 'r') as f:
+		raw = yaml.safe_load(f)
+	default_profile = ModelProfile(**raw.get('default', {}))
+	profiles = {name: ModelProfile(**{**raw.get('default', {}), **values}) for name, values in raw.get('models', {}).items()}
+	return profiles, default_profile
+
+
+def serve(host: str = '127.0.0.1',
+          port: int = 11434,
+          profiles: Optional[str] = './resources/mock_ollama_profiles.yml',
+          max_loaded: int = 3,
+          seed: int = 0,
+          time_scale: float = 1.0) -> None:
+	model_profiles, default_profile = load_profiles(profiles)
+	MockOllamaHandler.mock = MockOllama(profiles=model_profiles,
+	                                    default_profile=default_profile,
+	                                    max_loaded=max_loaded,
+	                                    seed=seed,
+	                                    time_scale=time_scale)
+	server = ThreadingHTTPServer((host, port), MockOllamaHandler)
+	print(f'Mock Ollama listening on http://{host}:{port} (set OLLAMA_HOST to use it)')
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	fire.Fire(serve)
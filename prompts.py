@@ -0,0 +1,51 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+PROMPT_LAYOUTS = ['original', 'prefix']
+# Sections of the system prompts that change between calls (level state, operation of the call)
+VOLATILE_SECTIONS = ('Level', 'Operation', 'Parameters', 'Requested Operations')
+LEVEL_CHANGES_SECTION = """<Level Changes>
+The level above has since been changed as follows (+ added, - removed, ~ updated):
+{level_changes}"""
+
+
+@lru_cache(maxsize=None)
+def split_prompt(prompt: str,
+                 volatile: Tuple[str, ...] = VOLATILE_SECTIONS) -> Tuple[str, str]:
+	# Splits a system prompt template on its `<Section>` headings into the stable and the volatile sections
+	sections = re.split(r'(?m)^(?=<[^>\n]+>$)', prompt)
+	stable, changing = [], []
+	for section in sections:
+		if section.strip() == '': continue
+		heading = re.match(r'<([^>\n]+)>', section)
+		(changing if heading is not None and heading.group(1) in volatile else stable).append(section.strip())
+	return '\n\n'.join(stable), '\n\n'.join(changing)
+
+
+def build_messages(prompt: str,
+                   history: List[Dict[str, str]],
+                   user_content: str,
+                   layout: str = 'original',
+                   volatile: Tuple[str, ...] = VOLATILE_SECTIONS,
+                   level_changes: str = '',
+                   **values) -> List[Dict[str, str]]:
+	"""
+	Assembles the messages of a call. With the 'prefix' layout, the system prompt only holds the stable instructions,
+	so it and the conversation history are a common prefix of successive calls that the server can keep cached;
+	the volatile sections (e.g. the level) are sent with the last user message instead.
+	Changes to the level (see LevelDeltaRenderer) are always sent with the last user message.
+	"""
+	assert layout in PROMPT_LAYOUTS, f'Unknown prompt layout: {layout}'
+	if level_changes != '':
+		user_content = f'{LEVEL_CHANGES_SECTION.format(level_changes=level_changes)}\n\n{user_content}'
+	if layout == 'prefix':
+		stable, changing = split_prompt(prompt, volatile)
+		if changing != '':
+			user_content = f'{changing.format(**values)}\n\n{user_content}'
+		prompt = stable
+	return [
+		{'role': 'system', 'content': prompt.format(**values)},
+		*history,
+		{'role': 'user', 'content': user_content}
+	]
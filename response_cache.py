@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from cassette import request_key, to_dict
+from configs import config
+
+
+class ResponseCache:
+	"""
+	Content-addressed cache of chat responses, keyed like the cassettes by a hash of the model, messages, tools and
+	options (which include the seed). Responses are kept in an in-memory LRU of `memory_size` entries and, if
+	`disk_dir` is set, in one JSON file per request, evicting the least recently used files above `max_size_mb`.
+	Only use it with a fixed seed: the cache assumes identical requests get identical responses.
+	"""
+	def __init__(self,
+	             memory_size: int = 256,
+	             disk_dir: Optional[str] = None,
+	             max_size_mb: float = 512):
+		self.memory_size = memory_size
+		self.disk_dir = disk_dir
+		self.max_size = int(max_size_mb * 1024 * 1024)
+		self.memory_hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.__lock = threading.Lock()
+		self.__memory: Dict[str, Dict[str, Any]] = OrderedDict()
+		self.__disk: Dict[str, int] = OrderedDict()  # Size of each file, least recently used first
+		self.__disk_size = 0
+		if self.disk_dir is not None:
+			os.makedirs(self.disk_dir, exist_ok=True)
+			self.__load_index()
+	
+	def __load_index(self) -> None:
+		entries = []
+		for dirpath, _, fnames in os.walk(self.disk_dir):
+			for fname in fnames:
+				if fname.endswith('.json'):
+					stat = os.stat(os.path.join(dirpath, fname))
+					entries.append((stat.st_mtime, fname[:-len('.json')], stat.st_size))
+		for _, key, size in sorted(entries):
+			self.__disk[key] = size
+			self.__disk_size += size
+	
+	def __path(self,
+	           key: str) -> str:
+		return os.path.join(self.disk_dir, key[:2], f'{key}.json')
+	
+	@staticmethod
+	def key(request: Dict[str, Any]) -> str:
+		request = dict(request)
+		return request_key(api='chat', model=request.pop('model'), **request)
+	
+	def __remember(self,
+	               key: str,
+	               response: Dict[str, Any]) -> None:
+		self.__memory[key] = response
+		self.__memory.move_to_end(key)
+		while len(self.__memory) > self.memory_size:
+			self.__memory.popitem(last=False)
+	
+	def get(self,
+	        request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+		key = ResponseCache.key(request)
+		with self.__lock:
+			if key in self.__memory:
+				self.memory_hits += 1
+				self.__memory.move_to_end(key)
+				return self.__memory[key]
+			if key in self.__disk:
+				try:
+					with open(self.__path(key), 'r') as f:
+						response = json.load(f)
+				except (OSError, json.JSONDecodeError):
+					self.__disk_size -= self.__disk.pop(key)
+				else:
+					self.disk_hits += 1
+					self.__disk.move_to_end(key)
+					os.utime(self.__path(key))  # Recency survives restarts
+					self.__remember(key=key, response=response)
+					return response
+			self.misses += 1
+			return None
+	
+	def put(self,
+	        request: Dict[str, Any],
+	        response: Any) -> None:
+		key = ResponseCache.key(request)
+		response = to_dict(response)
+		with self.__lock:
+			self.__remember(key=key, response=response)
+			if self.disk_dir is None or key in self.__disk:
+				return
+			path = self.__path(key)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(f'{path}.tmp', 'w') as f:
+				json.dump(response, f, default=str)
+			os.replace(f'{path}.tmp', path)  # Readers never see a partial file
+			self.__disk[key] = os.path.getsize(path)
+			self.__disk_size += self.__disk[key]
+			while self.__disk_size > self.max_size and len(self.__disk) > 1:
+				old_key, size = self.__disk.popitem(last=False)
+				self.__disk_size -= size
+				self.evictions += 1
+				try:
+					os.remove(self.__path(old_key))
+				except OSError:
+					pass
+	
+	def __str__(self) -> str:
+		return (f'ResponseCache(memory_hits={self.memory_hits}, disk_hits={self.disk_hits}, misses={self.misses}, '
+		        f'evictions={self.evictions}, disk_size={self.__disk_size / (1024 * 1024):.1f}MB)')
+
+
+@lru_cache(maxsize=None)
+def shared_response_cache() -> ResponseCache:
+	# One cache per process, shared by all the LLMs (and the workers of a sweep)
+	return ResponseCache(memory_size=config.llm.response_cache.memory_size,
+	                     disk_dir=config.llm.response_cache.dir,
+	                     max_size_mb=config.llm.response_cache.max_size_mb)
+
+
+def get_response_cache(enabled: Optional[bool] = None) -> Optional[ResponseCache]:
+	enabled = enabled if enabled is not None else config.llm.response_cache.enabled
+	return shared_response_cache() if enabled else None
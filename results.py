@@ -0,0 +1,130 @@
+import csv
+import os
+import threading
+from typing import Any, Callable, Dict, List
+
+from manifest import fsync_dir
+
+RESULTS_COLUMNS = [
+	'intent_llm',
+	'params_llm',
+	'summary_llm',
+	'chat_llm',
+	'run_n',
+	'logfile',
+	'seed',
+	'test_case',
+	'step',
+	'query',
+	'success',
+	'level',
+	'response',
+	'expected_intents',
+	'valid_domain',
+	'valid_design',
+	'elapsed_time'
+]
+
+
+class ResultsWriter:
+	"""
+	Append-only CSV sink for per-step results.
+	Rows are buffered and appended in batches, so the cost per step does not grow with the size of the sweep.
+	Every flush is fsync'd; rows of jobs that never finished are removed by `compact` when resuming.
+	"""
+	def __init__(self,
+	             fname: str,
+	             columns: List[str] = RESULTS_COLUMNS,
+	             flush_every: int = 50):
+		self.fname = fname
+		self.columns = columns
+		self.flush_every = flush_every
+		self.__buffer: List[List[Any]] = []
+		self.__lock = threading.Lock()
+		self.__f = None
+		self.__writer = None
+
+	def __open(self) -> None:
+		new_file = not os.path.exists(self.fname) or os.path.getsize(self.fname) == 0
+		self.__f = open(self.fname, 'a', newline='')
+		self.__writer = csv.writer(self.__f)
+		if new_file:
+			self.__writer.writerow(self.columns)
+			self.__sync()
+			fsync_dir(os.path.dirname(self.fname) or '.')
+
+	def __sync(self) -> None:
+		self.__f.flush()
+		os.fsync(self.__f.fileno())
+
+	def reset(self) -> None:
+		with self.__lock:
+			self.__close()
+			with open(self.fname, 'w'):
+				pass
+			self.__buffer = []
+
+	def compact(self,
+	            keep: Callable[[Dict[str, str]], bool]) -> int:
+		# Rewrite the file with only the rows to keep; this is the only full pass over the results
+		with self.__lock:
+			self.__close()
+			if not os.path.exists(self.fname):
+				return 0
+			n_kept = 0
+			tmp_fname = f'{self.fname}.tmp'
+			with open(self.fname, 'r', newline='') as f_in, open(tmp_fname, 'w', newline='') as f_out:
+				reader = csv.reader(f_in)
+				header = next(reader, None)
+				writer = csv.writer(f_out)
+				writer.writerow(self.columns)
+				if header is not None:
+					for values in reader:
+						# Rows torn by a kill have the wrong number of fields
+						if len(values) != len(header): continue
+						row = dict(zip(header, values))
+						if keep(row):
+							writer.writerow([row.get(column, '') for column in self.columns])
+							n_kept += 1
+				f_out.flush()
+				os.fsync(f_out.fileno())
+			os.replace(tmp_fname, self.fname)
+			fsync_dir(os.path.dirname(self.fname) or '.')
+			return n_kept
+
+	def write_row(self,
+	              row: Dict[str, Any]) -> None:
+		with self.__lock:
+			self.__buffer.append([row.get(column, '') for column in self.columns])
+			if len(self.__buffer) >= self.flush_every:
+				self.__flush()
+
+	def flush(self) -> None:
+		with self.__lock:
+			self.__flush()
+
+	def __flush(self) -> None:
+		if self.__f is None:
+			self.__open()
+		if len(self.__buffer) > 0:
+			self.__writer.writerows(self.__buffer)
+			self.__buffer = []
+		self.__sync()
+
+	def close(self) -> None:
+		with self.__lock:
+			if len(self.__buffer) > 0:
+				self.__flush()
+			self.__close()
+
+	def __close(self) -> None:
+		if self.__f is not None:
+			self.__f.close()
+			self.__f = None
+			self.__writer = None
+
+	def __enter__(self) -> 'ResultsWriter':
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.close()
@@ -0,0 +1,161 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+
+class SweepJob(NamedTuple):
+	intent_llm: str
+	params_llm: Optional[str]  # None when running in tool mode
+	run_n: int
+	tcase: str
+
+	@property
+	def group(self) -> Tuple[str, Optional[str]]:
+		return self.intent_llm, self.params_llm
+	
+	@property
+	def use_case(self) -> int:
+		return int(self.tcase[-1])  # Same convention as TestCase
+	
+	@property
+	def results_key(self) -> Tuple[str, str, int, int]:
+		# Identifies the rows of this job in summary_results.csv
+		return self.intent_llm, self.params_llm if self.params_llm is not None else 'N/A', self.run_n, self.use_case
+
+
+def build_jobs(intent_llms: List[str],
+               params_llms: Optional[List[str]],
+               n_runs: int,
+               tcases: List[str]) -> List[SweepJob]:
+	jobs = []
+	for intent_llm in intent_llms:
+		for params_llm in (params_llms if params_llms is not None else [None]):
+			for run_n in range(n_runs):
+				for tcase in tcases:
+					jobs.append(SweepJob(intent_llm=intent_llm,
+					                     params_llm=params_llm,
+					                     run_n=run_n,
+					                     tcase=tcase))
+	return jobs
+
+
+def group_jobs(jobs: List[SweepJob]) -> Dict[Tuple[str, Optional[str]], List[SweepJob]]:
+	# Jobs in the same group need the same models loaded, so they can share a warm server
+	groups = {}
+	for job in jobs:
+		groups.setdefault(job.group, []).append(job)
+	return groups
+
+
+def group_models(group: Tuple[str, Optional[str]]) -> Set[str]:
+	return {model_name for model_name in group if model_name is not None}
+
+
+def count_model_loads(order: List[Tuple[str, Optional[str]]],
+                      resident: Set[str]) -> int:
+	# Mirrors main.load_group_models: models in `resident` stay loaded (other roles), and only the models the next group does not need are stopped
+	n_loads = 0
+	loaded = set()
+	for group in order:
+		needed = group_models(group)
+		n_loads += len(needed - loaded - resident)
+		loaded = needed
+	return n_loads
+
+
+def plan_group_order(groups: List[Tuple[str, Optional[str]]],
+                     resident: Set[str]) -> List[Tuple[str, Optional[str]]]:
+	# Greedy nearest neighbour: always move to the group needing the fewest new models
+	remaining = list(groups)
+	order = []
+	loaded = set()
+	while len(remaining) > 0:
+		def cost(group: Tuple[str, Optional[str]]) -> Tuple[int, int]:
+			needed = group_models(group)
+			# Prefer groups that keep more of the loaded models, as they leave more cheap moves for later
+			return len(needed - loaded - resident), -len(needed & loaded)
+		best = min(remaining, key=cost)  # Ties keep the original order
+		remaining.remove(best)
+		order.append(best)
+		loaded = group_models(best)
+	return order
+
+
+class SweepScheduler:
+	def __init__(self,
+	             n_workers: int = 1,
+	             async_mode: bool = False):
+		assert n_workers > 0, f'Invalid number of workers: {n_workers}'
+		self.n_workers = n_workers  # Threads, or concurrent conversations on one event loop in async mode
+		self.async_mode = async_mode
+		self.__executor: Optional[ThreadPoolExecutor] = None
+
+	def __enter__(self) -> 'SweepScheduler':
+		if self.n_workers > 1 and not self.async_mode:
+			self.__executor = ThreadPoolExecutor(max_workers=self.n_workers)
+		return self
+
+	def __exit__(self, *args) -> None:
+		if self.__executor is not None:
+			self.__executor.shutdown(wait=True, cancel_futures=True)
+			self.__executor = None
+
+	def run_group(self,
+	              jobs: List[SweepJob],
+	              run_job: Callable[[SweepJob], Any],
+	              on_job_done: Callable[[SweepJob, Any], None]) -> None:
+		if self.__executor is None:
+			for job in jobs:
+				on_job_done(job, run_job(job))
+			return
+		futures = {self.__executor.submit(run_job, job): job for job in jobs}
+		first_error = None
+		for future in as_completed(futures):
+			try:
+				result = future.result()
+			except Exception as e:
+				# Stop scheduling the rest of the group but keep the results of jobs that already finished
+				if first_error is None:
+					first_error = e
+					for other in futures:
+						other.cancel()
+				continue
+			on_job_done(futures[future], result)
+		if first_error is not None:
+			raise first_error
+
+	def run_group_async(self,
+	                    jobs: List[SweepJob],
+	                    run_job: Callable[[SweepJob], Awaitable[Any]],
+	                    on_job_done: Callable[[SweepJob, Any], None]) -> None:
+		asyncio.run(self.__run_group_async(jobs=jobs,
+		                                   run_job=run_job,
+		                                   on_job_done=on_job_done))
+
+	async def __run_group_async(self,
+	                            jobs: List[SweepJob],
+	                            run_job: Callable[[SweepJob], Awaitable[Any]],
+	                            on_job_done: Callable[[SweepJob, Any], None]) -> None:
+		semaphore = asyncio.Semaphore(self.n_workers)
+
+		async def run(job: SweepJob) -> Tuple[SweepJob, Any]:
+			async with semaphore:
+				return job, await run_job(job)
+
+		tasks = [asyncio.create_task(run(job)) for job in jobs]
+		first_error = None
+		for next_done in asyncio.as_completed(tasks):
+			try:
+				job, result = await next_done
+			except asyncio.CancelledError:
+				continue
+			except Exception as e:
+				# Same policy as run_group: cancel the rest of the group but keep the jobs that already finished
+				if first_error is None:
+					first_error = e
+					for task in tasks:
+						task.cancel()
+				continue
+			on_job_done(job, result)
+		if first_error is not None:
+			raise first_error
@@ -0,0 +1,47 @@
+from typing import Dict, List, Optional, Tuple
+
+# Results of the params role that are not tool outputs (see FreyrLLM.generate_params_and_execute_tool)
+RETRIES_EXHAUSTED = 'End of retries; failed with {error}'
+NOT_EXECUTED = 'It was not possible to execute {operation}.'
+# Prefixes of the outputs of `DungeonCrawlerFunctions.try_call_func` for calls that failed
+TOOL_ERRORS = ('Domain validation error', 'Missing arguments')
+
+# How to report the outcome of an operation of a turn
+OUTCOME_TEMPLATES: Dict[str, str] = {
+	'done': 'Done ({operation}): {output}',
+	'failed': 'I could not {operation}: {error}',
+	'not_executed': 'I could not {operation}.',
+}
+
+
+def classify_outcome(tool_result: str,
+                     operation: str) -> Optional[Tuple[str, Dict[str, str]]]:
+	# The template of a tool result and its values, or None if it is not a common outcome
+	tool_result = tool_result.strip()
+	values = {'operation': operation.replace('_', ' ')}
+	retries_prefix = RETRIES_EXHAUSTED.split('{')[0]
+	if tool_result.startswith(retries_prefix):
+		return 'failed', {**values, 'error': tool_result[len(retries_prefix):].strip().rstrip('.') + '.'}
+	if tool_result == NOT_EXECUTED.format(operation=operation):
+		return 'not_executed', values
+	if tool_result == '' or '\n' in tool_result or tool_result.startswith(TOOL_ERRORS):
+		return None
+	return 'done', {**values, 'output': tool_result}
+
+
+def render_summary(tool_results: List[str],
+                   operations: List[str]) -> Tuple[str, List[str]]:
+	"""
+	Summarises the results of the operations of a turn from OUTCOME_TEMPLATES, one sentence per result.
+	The success messages of the tools are reported as they are, so only the failures need to be recognised.
+	Returns the summary and the results that are not a common outcome, which are left out of it.
+	"""
+	sentences, unmatched = [], []
+	for i, tool_result in enumerate(tool_results):
+		outcome = classify_outcome(tool_result=tool_result, operation=operations[i]) if i < len(operations) else None
+		if outcome is None:
+			unmatched.append(tool_result)
+		else:
+			template, values = outcome
+			sentences.append(OUTCOME_TEMPLATES[template].format(**values))
+	return ' '.join(sentences), unmatched
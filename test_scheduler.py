@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pytest
+
+from scheduler import build_jobs, count_model_loads, group_jobs, plan_group_order
+
+# The estimate is checked against the models actually loaded by main
+pytest.importorskip('dungeon_despair')
+pytest.importorskip('ollama')
+pytest.importorskip('fire')
+
+from freyr_llm import LLMsCache
+from main import load_group_models
+
+
+class LoadCountingClient:
+	# Just enough of the ollama API to keep track of the running models
+	def __init__(self,
+	             models: List[str]):
+		self.models = models
+		self.running: Set[str] = set()
+		self.n_loads = 0
+
+	def list(self) -> Dict[str, Any]:
+		return {'models': [{'name': x} for x in self.models] + [{'name': f'{x}:latest'} for x in self.models]}
+
+	def ps(self) -> Dict[str, Any]:
+		return {'models': [{'name': x} for x in self.running]}
+
+	def generate(self,
+	             model: str,
+	             keep_alive: int) -> None:
+		if keep_alive == 0:
+			self.running.discard(model)
+		elif model not in self.running:
+			self.running.add(model)
+			self.n_loads += 1
+
+
+def run_sweep(order: List[Tuple[str, Optional[str]]],
+              other_llm: str,
+              models: List[str]) -> int:
+	client = LoadCountingClient(models=models + [other_llm])
+	cache = LLMsCache(client=client)
+	cache.timeout = 0
+	cache.try_add_model(role='chat', model_name=other_llm)
+	n_loads = client.n_loads
+	for intent_llm, params_llm in order:
+		load_group_models(llmcache=cache,
+		                  intent_llm=intent_llm,
+		                  params_llm=params_llm,
+		                  outlines_mode=False)
+	return client.n_loads - n_loads
+
+
+@pytest.mark.parametrize('planned', [True, False])
+def test_estimated_loads_match_actual_loads(planned: bool):
+	models, other_llm = ['a', 'b', 'c'], 'other'
+	groups = list(group_jobs(build_jobs(intent_llms=models + [other_llm], params_llms=models, n_runs=1, tcases=['t_1'])).keys())
+	order = plan_group_order(groups=groups, resident={other_llm}) if planned else groups
+	assert count_model_loads(order=order, resident={other_llm}) == run_sweep(order=order, other_llm=other_llm, models=models)
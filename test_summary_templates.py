@@ -0,0 +1,97 @@
+import json
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+from summary_templates import NOT_EXECUTED, OUTCOME_TEMPLATES, RETRIES_EXHAUSTED, TOOL_ERRORS, classify_outcome, render_summary
+
+# The outcomes are checked against the outputs of the actual tools
+pytest.importorskip('dungeon_despair')
+pytest.importorskip('ollama')
+
+from context import RunContext
+from freyr_llm import FreyrLLM, LLMsCache
+from logger import CustomLogger
+from dungeon_despair.domain.level import Level
+from dungeon_despair.functions import DungeonCrawlerFunctions
+
+
+class OfflineClient:
+	# Just enough of the ollama API to give a role a model; the chat calls are answered by `run_steps`
+	def list(self) -> Dict[str, Any]:
+		return {'models': [{'name': 'offline'}, {'name': 'offline:latest'}]}
+
+	def generate(self, **kwargs) -> None:
+		pass
+
+
+def run_steps(steps, reply: Callable[[Dict[str, Any]], str]) -> Any:
+	try:
+		request = next(steps)
+		while True:
+			request = steps.send({'message': {'content': reply(request)}, 'prompt_eval_count': 0, 'eval_count': 0})
+	except StopIteration as e:
+		return e.value
+
+
+def empty_level() -> Level:
+	return Level.load_from_file('./resources/levels/empty.bin')[0]
+
+
+@pytest.fixture(scope='module')
+def llm(tmp_path_factory: pytest.TempPathFactory) -> FreyrLLM:
+	cache = LLMsCache(client=OfflineClient())
+	cache.try_add_model(role='params', model_name='offline')
+	context = RunContext(logger=CustomLogger(dir_name='test_summary_templates', expname='test', root=str(tmp_path_factory.mktemp('experiments'))))
+	return FreyrLLM(cache=cache, context=context, summary_mode='templates', response_cache=False)
+
+
+operations = [tool['function']['name'] for tool in DungeonCrawlerFunctions().get_tool_schema()]
+
+
+def test_tool_errors_are_not_common_outcomes():
+	level = empty_level()
+	outputs = [DungeonCrawlerFunctions().try_call_func(func_name=operation, func_args=json.dumps({}), level=level)
+	           for operation in operations]
+	errors = [output for output in outputs if output.startswith(TOOL_ERRORS)]
+	assert len(errors) > 0, f'No output starts with {TOOL_ERRORS}: {outputs}'
+	for operation, output in zip(operations, outputs):
+		if output in errors:
+			assert classify_outcome(tool_result=output, operation=operation) is None
+
+
+@pytest.mark.parametrize('operation', operations)
+def test_params_role_not_executed(llm: FreyrLLM, operation: str):
+	output = run_steps(steps=llm.generate_params_and_execute_tool_steps(conversation_history=[],
+	                                                                    user_message='Make a room in a swamp',
+	                                                                    intent=operation,
+	                                                                    level=empty_level()),
+	                   reply=lambda _: llm.PARAM_ERROR_MSG)
+	assert output == NOT_EXECUTED.format(operation=operation)
+	summary, unmatched = render_summary(tool_results=[output], operations=[operation])
+	assert unmatched == []
+	assert summary == OUTCOME_TEMPLATES['not_executed'].format(operation=operation.replace('_', ' '))
+
+
+@pytest.mark.parametrize('operation', operations)
+def test_params_role_outcomes_are_common(llm: FreyrLLM, operation: str):
+	# Whether the empty parameters are accepted or not, the params role ends with a common outcome
+	empty_params = '\n'.join(f'- {param_name}: ' for param_name in llm.get_tool_parameters(tool_name=operation))
+	output = run_steps(steps=llm.generate_params_and_execute_tool_steps(conversation_history=[],
+	                                                                    user_message='Make a room in a swamp',
+	                                                                    intent=operation,
+	                                                                    level=empty_level()),
+	                   reply=lambda _: empty_params)
+	summary, unmatched = render_summary(tool_results=[output], operations=[operation])
+	assert unmatched == []
+	if output.startswith(RETRIES_EXHAUSTED.split('{')[0]):
+		assert summary.startswith(f"I could not {operation.replace('_', ' ')}: ")
+	else:
+		assert summary == OUTCOME_TEMPLATES['done'].format(operation=operation.replace('_', ' '), output=output.strip())
+
+
+def test_results_follow_operations():
+	results: List[str] = [RETRIES_EXHAUSTED.format(error='Room Swamp does not exist'), 'Some\nmulti-line output']
+	summary, unmatched = render_summary(tool_results=results, operations=['add_enemy'])
+	assert summary == 'I could not add enemy: Room Swamp does not exist.'
+	assert unmatched == ['Some\nmulti-line output']  # No operation to report it under
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from configs import config
+
+CHARS_PER_TOKEN = 4  # Rough average for English text and JSON-like level descriptions
+
+model_to_hf_repo = {
+	'llama3.1': 'meta-llama/Llama-3.1-8B',
+	'qwen2.5': 'Qwen/Qwen2.5-7B',
+	'qwen2.5:0.5b': 'Qwen/Qwen2.5-0.5B',
+	'gemma2': 'google/gemma-2-9b',
+	'gemma2:27b': 'google/gemma-2-27b',
+	'command-r': 'CohereForAI/c4ai-command-r-v01',
+}
+
+model_context_length = {
+	'llama3.1': 131072,
+	'qwen2.5': 32768,
+	'qwen2.5:0.5b': 32768,
+	'gemma2': 8192,
+	'gemma2:27b': 8192,
+	'command-r': 131072,
+}
+
+MESSAGE_OVERHEAD = 4  # Role and delimiter tokens the chat template adds around each message
+
+
+def estimate_tokens(text: str) -> int:
+	return len(text) // CHARS_PER_TOKEN
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+	# Approximate size of the whole prompt, i.e. what the server prefills without a cached prefix
+	return sum(estimate_tokens(message.get('content', '')) for message in messages)
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str) -> Optional[Any]:
+	"""
+	Load the tokenizer of `model_name` from `config.llm.tokens_dir` (one folder per Hugging Face repo, e.g.
+	`Qwen/Qwen2.5-7B`). Returns None if the model is unknown, the tokenizer has not been downloaded or
+	`transformers` is not installed, so callers can fall back to `estimate_tokens`.
+	"""
+	if model_name not in model_to_hf_repo:
+		return None
+	path = os.path.join(config.llm.tokens_dir, model_to_hf_repo[model_name])
+	if not os.path.isdir(path):
+		return None
+	try:
+		from transformers import AutoTokenizer
+		return AutoTokenizer.from_pretrained(path)
+	except (ImportError, OSError, ValueError):
+		return None
+
+
+def count_tokens(text: str,
+                 model_name: Optional[str] = None) -> int:
+	tokenizer = get_tokenizer(model_name) if model_name is not None else None
+	if tokenizer is None:
+		return estimate_tokens(text)
+	return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def count_prompt_tokens(messages: List[Dict[str, str]],
+                        model_name: Optional[str] = None,
+                        tools: Optional[List[Dict[str, Any]]] = None) -> int:
+	"""
+	Predict the prompt tokens of a chat call before it is sent: with the model's chat template if its tokenizer
+	has one, otherwise by counting each message plus a small per-message overhead.
+	"""
+	tokenizer = get_tokenizer(model_name) if model_name is not None else None
+	if tokenizer is not None and getattr(tokenizer, 'chat_template', None):
+		try:
+			return len(tokenizer.apply_chat_template(messages, tools=tools, tokenize=True, add_generation_prompt=True, return_dict=False))
+		except Exception:
+			pass  # Templates that reject some roles or the tools format
+	n_tokens = sum(count_tokens(message.get('content') or '', model_name=model_name) + MESSAGE_OVERHEAD for message in messages)
+	if tools:
+		n_tokens += count_tokens(json.dumps(tools), model_name=model_name)
+	return n_tokens
+
+
+def oldest_group_end(messages: List[Dict[str, Any]],
+                     start: int) -> int:
+	# End of the oldest messages from `start` that can only be dropped together: a tool call and its tool replies
+	end = start + 1
+	if messages[start]['role'] == 'tool' or messages[start].get('tool_calls'):
+		while end < len(messages) and messages[end]['role'] == 'tool':
+			end += 1
+	return end
+
+
+class PromptTooLargeError(ValueError):
+	pass
+
+
+class PromptGuard:
+	"""
+	Sizes the context of each call from its predicted prompt tokens, instead of a fixed `num_ctx`.
+	The context is rounded up to a power of two and never shrinks for a model, since Ollama reloads a model whenever
+	its `num_ctx` changes; use the process-wide guard (see `get_prompt_guard`) so all the jobs agree on it. Prompts that would not fit in the model's context are compacted by dropping the oldest
+	messages between the system prompt and the last message, a tool call together with its replies, and rejected if
+	that is not enough.
+	"""
+	def __init__(self,
+	             min_ctx: int = 2048,
+	             max_ctx: int = 65536,
+	             completion_reserve: int = 1024):
+		self.min_ctx = min_ctx
+		self.max_ctx = max_ctx
+		self.completion_reserve = completion_reserve  # Room left for the reply
+		self.n_compacted = 0
+		self.__lock = threading.Lock()
+		self.__num_ctx: Dict[str, int] = {}
+	
+	def fit(self,
+	        model_name: str,
+	        messages: List[Dict[str, str]],
+	        tools: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, str]], int, int]:
+		# Returns the messages to send, their predicted prompt tokens and the `num_ctx` of the call
+		max_ctx = min(self.max_ctx, model_context_length.get(model_name, self.max_ctx))
+		n_tokens = count_prompt_tokens(messages=messages, model_name=model_name, tools=tools)
+		if n_tokens + self.completion_reserve > max_ctx:
+			head = 1 if len(messages) > 0 and messages[0]['role'] == 'system' else 0
+			messages = list(messages)
+			while n_tokens + self.completion_reserve > max_ctx:
+				end = oldest_group_end(messages=messages, start=head)
+				if end >= len(messages):
+					break  # The last message is always sent
+				del messages[head:end]
+				n_tokens = count_prompt_tokens(messages=messages, model_name=model_name, tools=tools)
+			with self.__lock:
+				self.n_compacted += 1
+			if n_tokens + self.completion_reserve > max_ctx:
+				raise PromptTooLargeError(f'Prompt of {n_tokens} tokens does not fit in the {max_ctx} tokens context of {model_name}')
+		num_ctx = self.min_ctx
+		while num_ctx < n_tokens + self.completion_reserve:
+			num_ctx *= 2
+		with self.__lock:
+			num_ctx = max(min(num_ctx, max_ctx), self.__num_ctx.get(model_name, 0))
+			self.__num_ctx[model_name] = num_ctx
+		return messages, n_tokens, num_ctx
+
+
+@lru_cache(maxsize=None)
+def shared_prompt_guard() -> PromptGuard:
+	# One guard per process, shared by all the LLMs (and the workers of a sweep)
+	return PromptGuard(min_ctx=config.llm.num_ctx.min,
+	                   max_ctx=config.llm.num_ctx.max,
+	                   completion_reserve=config.llm.num_ctx.completion_reserve)
+
+
+def get_prompt_guard() -> PromptGuard:
+	return shared_prompt_guard()
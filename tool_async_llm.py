@@ -0,0 +1,51 @@
+from timeit import default_timer
+from typing import Any, Dict, List, Optional
+
+import ollama
+
+from context import RunContext
+from freyr_async_llm import get_async_client
+from llm_steps import adrive
+from tool_llm import ToolCallingLLM
+from dungeon_despair.domain.level import Level
+
+
+class AsyncToolCallingLLM(ToolCallingLLM):
+	"""
+	ToolCallingLLM whose model calls are awaited, so many conversations can share a single event loop.
+	"""
+	def __init__(self,
+	             model_name: str,
+	             keep_loaded: bool = False,
+	             context: Optional[RunContext] = None,
+	             client: Any = ollama,
+	             async_client: Optional[Any] = None,
+	             prompt_layout: Optional[str] = None,
+	             history: Optional[bool] = None,
+	             response_cache: Optional[bool] = None):
+		super().__init__(model_name=model_name, keep_loaded=keep_loaded, context=context, client=client, prompt_layout=prompt_layout,
+		                 history=history, response_cache=response_cache)
+		self.async_client = async_client if async_client is not None else get_async_client(client=client)
+	
+	async def __achat(self,
+	                  messages: List[Dict[str, str]],
+	                  tools: bool = True) -> Dict[str, Any]:
+		request, prompt_size = self._chat_request(messages=messages, tools=tools)
+		res = self.response_cache.get(request) if self.response_cache is not None else None
+		if res is None:
+			start = default_timer()
+			res = await self.async_client.chat(**request)
+			end = default_timer()
+			self._chat_done(res=res, elapsed=end - start, prompt_size=prompt_size)
+			if self.response_cache is not None:
+				self.response_cache.put(request=request, response=res)
+		return res
+	
+	async def __call__(self,
+	                   user_message: str,
+	                   conversation_history: List[str],
+	                   level: Level) -> str:
+		return await adrive(achat=self.__achat,
+		                    steps=self.call_steps(user_message=user_message,
+		                                          conversation_history=conversation_history,
+		                                          level=level))
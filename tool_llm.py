@@ -1,103 +1,183 @@
-import subprocess
 from time import sleep
 from timeit import default_timer
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 import ollama
 
 from configs import config
+from context import RunContext
+from history import HistoryCompactor, get_history_compactor
+from llm_steps import Steps, drive
+from prompts import build_messages
+from response_cache import get_response_cache
+from tokens import get_prompt_guard
+from tool_schema import get_tool_schema_index
 from dungeon_despair.domain.level import Level
 from dungeon_despair.functions import DungeonCrawlerFunctions
-from logger import custom_logger
 
 
 class ToolCallingLLM:
 	def __init__(self,
-	             model_name: str):
+	             model_name: str,
+	             keep_loaded: bool = False,
+	             context: Optional[RunContext] = None,
+	             client: Any = ollama,
+	             prompt_layout: Optional[str] = None,
+	             history: Optional[bool] = None,
+	             response_cache: Optional[bool] = None):
 		self.timeout = 0.5
+		self.context = context if context is not None else RunContext()
+		self.client = client  # The ollama module or anything with the same API (e.g. a Cassette)
 		self.model_name = model_name
+		self.keep_loaded = keep_loaded  # Leave the model on the server when this object is deleted
+		self.prompt_layout = prompt_layout if prompt_layout is not None else config.llm.prompt_layout
 		self.tools = DungeonCrawlerFunctions()
+		self.schema = get_tool_schema_index()
+		self.history = get_history_compactor(count_model=model_name, enabled=history)
+		self.prompt_guard = get_prompt_guard()
+		self.response_cache = get_response_cache(enabled=response_cache)
 		with open('./resources/local_llm/tool_system_prompt', 'r') as f:
 			self.prompt = f.read()
-		ollama.generate(model=self.model_name, keep_alive=-1)
+		self.client.generate(model=self.model_name, keep_alive=-1)
 	
 	def __del__(self):
+		if not self.keep_loaded:
+			ToolCallingLLM.unload_model(model_name=self.model_name,
+			                            timeout=self.timeout,
+			                            client=self.client)
+	
+	@staticmethod
+	def unload_model(model_name: str,
+	                 timeout: float = 0.5,
+	                 client: Any = ollama) -> None:
 		try:
-			subprocess.check_call(['ollama', 'stop', self.model_name])
-			sleep(self.timeout)
-			assert self.model_name not in [x['name'] for x in ollama.ps()['models']], f'Could not stop model {self.model_name}'
-		except subprocess.CalledProcessError as e:
-			print(f'Failed to unload model {self.model_name}: {e}')
+			# Same as `ollama stop`, but through the client
+			client.generate(model=model_name, keep_alive=0)
+			sleep(timeout)
+			assert model_name not in [x['name'] for x in client.ps()['models']], f'Could not stop model {model_name}'
+		except ollama.ResponseError as e:
+			print(f'Failed to unload model {model_name}: {e}')
+	
+	def _chat_request(self,
+	                  messages: List[Dict[str, str]],
+	                  tools: bool = True) -> Tuple[Dict[str, Any], int]:
+		# Arguments of a chat call, shared by the blocking and the async clients, and its predicted prompt tokens
+		tools = self.schema.schema if tools else None
+		messages, n_tokens, num_ctx = self.prompt_guard.fit(model_name=self.model_name, messages=messages, tools=tools)
+		return {
+			'model': self.model_name,
+			'messages': messages,
+			**({'tools': tools} if tools else {}),
+			'options': {
+				**self.context.llm_options,
+				'num_ctx': num_ctx
+			}
+		}, n_tokens
+	
+	def _chat_done(self,
+	               res: Dict[str, Any],
+	               elapsed: float,
+	               prompt_size: int) -> None:
+		self.context.metrics.add_llm_call(llm_time=elapsed,
+		                                  prompt_tokens=res.get('prompt_eval_count', 0),
+		                                  completion_tokens=res.get('eval_count', 0),
+		                                  prompt_size=prompt_size)
 	
 	def __chat(self,
-	           messages: List[Dict[str, str]]) -> Dict[str, Any]:
-		options = {
-			'temperature': config.llm.temperature,
-			'top_p': config.llm.top_p,
-			'seed': config.rng_seed,
-			'num_ctx': 32768 * 2
-		}
-		res = ollama.chat(model=self.model_name,
-		                  messages=messages,
-		                  tools=self.tools.get_tool_schema(),
-		                  options=options)
+	           messages: List[Dict[str, str]],
+	           tools: bool = True) -> Dict[str, Any]:
+		request, prompt_size = self._chat_request(messages=messages, tools=tools)
+		res = self.response_cache.get(request) if self.response_cache is not None else None
+		if res is None:
+			start = default_timer()
+			res = self.client.chat(**request)
+			end = default_timer()
+			self._chat_done(res=res, elapsed=end - start, prompt_size=prompt_size)
+			if self.response_cache is not None:
+				self.response_cache.put(request=request, response=res)
 		return res
 	
 	def __call__(self,
 	             user_message: str,
 	             conversation_history: List[str],
 	             level: Level) -> str:
-		start = default_timer()
-		
-		conversation_messages = []
-		if len(conversation_history) > 0:
-			conversation_messages = [
-				{'role': 'user' if i % 2 == 0 else 'assistant', 'content': msg}
-				for i, msg in enumerate(conversation_history)
-			]
-		
-		prompt = self.prompt.format(level_str=str(level))
-		
-		messages = [
-			{'role': 'system', 'content': prompt},
-			*conversation_messages,
-			{'role': 'user', 'content': user_message}
-		]
-		
-		response = {'message': {'content': ''}}
-		n_retries = 3
-		
-		while response['message']['content'] == '':
-			log_msg = str(messages).replace('\n', '')
-			custom_logger.write_msg(source='ToolCallingLLM.__call__',
-			                        msg=f"messages={log_msg}; {n_retries=}")
-			start_inner = default_timer()
-			response = self.__chat(messages)
-			end_inner = default_timer()
-			custom_logger.write_msg(source='ToolCallingLLM.__call__',
-			                        msg=f'response={response["message"]}')
-			messages.append(response['message'])
-			custom_logger.write_msg(source='ToolCallingLLM.__call__',
-			                        msg=f'Prompt Tokens: {response["prompt_eval_count"]}; Completion Tokens: {response["eval_count"]}; Time: {(end_inner - start_inner):.4f}')
+		return drive(chat=self.__chat,
+		             steps=self.call_steps(user_message=user_message,
+		                                   conversation_history=conversation_history,
+		                                   level=level))
+	
+	def call_steps(self,
+	               user_message: str,
+	               conversation_history: List[str],
+	               level: Level) -> Steps:
+		with self.context.metrics.stage('ToolCallingLLM.__call__'):
+			start = default_timer()
+			
+			summary, idx = '', 0
+			if self.history is not None:
+				def log_summary_call(response: Dict[str, Any],
+				                     elapsed: float) -> None:
+					self.context.logger.write_msg(source='ToolCallingLLM.compact_history',
+					                              msg=f'Prompt Tokens: {response["prompt_eval_count"]}; Completion Tokens: {response["eval_count"]}; Time: {elapsed:.4f}')
+				
+				with self.context.metrics.stage('ToolCallingLLM.compact_history'):
+					# The summary is plain text, so the model is not offered the tools
+					summary, idx = yield from self.history.compact_steps(conversation_history=conversation_history,
+					                                                     summary_request={'tools': False},
+					                                                     on_response=log_summary_call)
+				self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+				                              msg=f'Summarised messages: {idx}; Verbatim messages: {len(conversation_history) - idx}; Summaries: {self.history.n_summaries}')
+			
+			conversation_messages = HistoryCompactor.summary_message(summary)
+			if len(conversation_history) > 0:
+				conversation_messages += [
+					{'role': 'user' if i % 2 == 0 else 'assistant', 'content': msg}
+					for i, msg in enumerate(conversation_history[idx:], start=idx)
+				]
+			
+			messages = build_messages(prompt=self.prompt,
+			                          history=conversation_messages,
+			                          user_content=user_message,
+			                          layout=self.prompt_layout,
+			                          level_str=str(level))
+			
+			response = {'message': {'content': ''}}
+			n_retries = 3
+			
+			while response['message']['content'] == '':
+				log_msg = str(messages).replace('\n', '')
+				self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+				                              msg=f"messages={log_msg}; {n_retries=}")
+				start_inner = default_timer()
+				response = yield {'messages': messages}
+				end_inner = default_timer()
+				self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+				                              msg=f'response={response["message"]}')
+				messages.append(response['message'])
+				self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+				                              msg=f'Prompt Tokens: {response["prompt_eval_count"]}; Completion Tokens: {response["eval_count"]}; Time: {(end_inner - start_inner):.4f}')
+				
+				if response['message'].get('tool_calls'):
+					for tool in response['message']['tool_calls']:
+						function_name = tool['function']['name']
+						params = tool['function']['arguments']
+						func_output = self.tools.try_call_func(func_name=function_name,
+						                                       func_args=params,
+						                                       level=level)
+						self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+						                              msg=f'{tool=} {func_output=}')
+						messages.append({'role': 'tool', 'content': func_output})
+					if n_retries == -1:
+						err_msg = f"End of retries; failed with {func_output}"
+						self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+						                              msg=err_msg)
+						return err_msg
+					n_retries -= 1
 			
-			if response['message'].get('tool_calls'):
-				for tool in response['message']['tool_calls']:
-					function_name = tool['function']['name']
-					params = tool['function']['arguments']
-					func_output = self.tools.try_call_func(func_name=function_name,
-					                                       func_args=params,
-					                                       level=level)
-					custom_logger.write_msg(source='ToolCallingLLM.__call__',
-					                        msg=f'{tool=} {func_output=}')
-					messages.append({'role': 'tool', 'content': func_output})
-				if n_retries == -1:
-					err_msg = f"End of retries; failed with {func_output}"
-					custom_logger.write_msg(source='ToolCallingLLM.__call__',
-					                        msg=err_msg)
-					return err_msg
-				n_retries -= 1
-		
-		end = default_timer()
-		custom_logger.write_msg(source='ToolCallingLLM.__call__',
-		                        msg=f'Time: {(end - start):.4f}')
-		return response['message']['content']
+			end = default_timer()
+			self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+			                              msg=f'Time: {(end - start):.4f}; Compacted prompts: {self.prompt_guard.n_compacted}')
+			if self.response_cache is not None:
+				self.context.logger.write_msg(source='ToolCallingLLM.__call__',
+				                              msg=str(self.response_cache))
+			return response['message']['content']
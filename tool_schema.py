@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import Any, Callable, Dict, List
+
+from dungeon_despair.functions import DungeonCrawlerFunctions
+
+JSON_TYPES = {
+	'string': str,
+	'integer': int,
+	'number': float
+}
+
+
+def make_coercer(param_type: type) -> Callable[[str], Any]:
+	# Converts a cleaned-up parameter value from a model response to the type of the parameter
+	def coerce(param_value: str) -> Any:
+		if param_value == '':
+			return param_type()
+		if param_type != str and param_value.lstrip('-').replace('.', '', 1).isdigit():
+			return param_type(eval(param_value))  # Allow for floats to be cast to int from string, basically
+		return param_type(param_value)
+	return coerce
+
+
+class ToolSchemaIndex:
+	"""
+	Lookup tables over the schema of DungeonCrawlerFunctions, so the prompts and the parsing of the model responses
+	do not scan the schema on every call.
+	"""
+	def __init__(self,
+	             tools: DungeonCrawlerFunctions):
+		self.schema: List[Dict[str, Any]] = tools.get_tool_schema()
+		self.descriptions: Dict[str, str] = {}
+		self.params: Dict[str, Dict[str, str]] = {}
+		self.param_types: Dict[str, Dict[str, str]] = {}
+		self.coercers: Dict[str, Dict[str, Callable[[str], Any]]] = {}
+		self.op_params_str: Dict[str, str] = {}
+		for tool in self.schema:
+			name = tool['function']['name']
+			properties = tool['function']['parameters']['properties']
+			self.descriptions[name] = tool['function']['description']
+			self.params[name] = {k: v['description'] for k, v in properties.items()}
+			self.param_types[name] = {k: v['type'] for k, v in properties.items()}
+			self.coercers[name] = {k: make_coercer(JSON_TYPES[t]) for k, t in self.param_types[name].items() if t in JSON_TYPES}
+			self.op_params_str[name] = str(self.params[name])
+	
+	def get_params(self,
+	               tool_name: str) -> Dict[str, str]:
+		if tool_name not in self.params:
+			raise ValueError(f'Unknown tool {tool_name}')
+		return self.params[tool_name]
+	
+	def get_param_type(self,
+	                   tool_name: str,
+	                   param_name: str) -> type:
+		t = self.param_types[tool_name][param_name]
+		if t not in JSON_TYPES: raise ValueError(f"Unknown type {t}")
+		return JSON_TYPES[t]
+	
+	def get_coercer(self,
+	                tool_name: str,
+	                param_name: str) -> Callable[[str], Any]:
+		if param_name not in self.coercers[tool_name]:
+			self.get_param_type(tool_name=tool_name, param_name=param_name)  # Raises the same errors as the type lookup
+		return self.coercers[tool_name][param_name]
+
+
+@lru_cache(maxsize=None)
+def get_tool_schema_index() -> ToolSchemaIndex:
+	# Built once per process and shared by every LLM
+	return ToolSchemaIndex(tools=DungeonCrawlerFunctions())